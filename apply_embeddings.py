@@ -1,14 +1,40 @@
 """ Given the data file and the embeddings, dump the corresponding embeddings
-of each text. """
+of each text. The embeddings can be a JSON file with the words as keys or the
+prefix of the embeddings exported by skipgram.utils.export_embeddings(), which
+load much faster. """
 
 
+from itertools import islice
 import json
+import os
+
+import numpy as np
+
+from json_stream import iter_items
+from skipgram.embeddings import Embeddings, load_matrix
+from sequence_store import SequenceStore
+
+
+def load_vecs(vecs_file):
+  """ Return the embeddings of the given JSON file or exported prefix. Both
+  map words to their vectors as lists. """
+  if vecs_file.endswith('.json'):
+    return json.load(open(vecs_file))
+  return Embeddings(vecs_file)
+
+
+def load_doc_vecs(prefix, mmap=True):
+  """ Return the IDs and the memory-mapped matrix of the document vectors
+  dumped by apply_sum_matrix(). """
+  with open(f'{prefix}.ids.txt', encoding='utf-8') as f:
+    ids = f.read().split('\n')[:-1]
+  return ids, np.load(f'{prefix}.npy', mmap_mode='r' if mmap else None)
 
 
 def apply(data_file, vecs_file, dump_file):
   """ The data file can only contain words that are present in the vocab. """
-  data = json.load(open(data_file), encoding='utf-8')
-  vecs = json.load(open(vecs_file))
+  data = json.load(open(data_file, encoding='utf-8'))
+  vecs = load_vecs(vecs_file)
   res = {}
   for doc_id in data:
     res[doc_id] = [vecs[w] for w in data[doc_id]]
@@ -18,8 +44,8 @@ def apply(data_file, vecs_file, dump_file):
 def apply_segmented(data_file, vecs_file, dump_prefix, n=3000):
   """ The data file can only contain words that are present in the vocab. Dump
   data in files with n items per file. """
-  data = json.load(open(data_file), encoding='utf-8')
-  vecs = json.load(open(vecs_file))
+  data = json.load(open(data_file, encoding='utf-8'))
+  vecs = load_vecs(vecs_file)
   res, file_nr = {}, 1
   for doc_id in data:
     res[doc_id] = [vecs[w] for w in data[doc_id]]
@@ -30,11 +56,22 @@ def apply_segmented(data_file, vecs_file, dump_prefix, n=3000):
   json.dump(res, open(f'{dump_prefix}_{file_nr}.json', 'w'))
 
 
+def apply_ragged(data_file, vecs_file, dump_prefix, n=3000,
+    materialize=False):
+  """ Alternative to apply_segmented() that stores the documents in a
+  SequenceStore, whose shards hold the rows of the words in the embedding
+  matrix instead of copies of their vectors. If the store exists, the docs
+  are appended to it. materialize determines whether the resolved vectors
+  are stored as well, and in which precision (see sequence_store). """
+  data = json.load(open(data_file, encoding='utf-8'))
+  SequenceStore(dump_prefix, vecs_file).append(data, n, materialize)
+
+
 def apply_sum(data_file, vecs_file, dump_file):
   """" Compute the vector embedding of each document, add the embeddings and
   dump them. The data file can only contain words of the vocab. """
-  data = json.load(open(data_file), encoding='utf-8')
-  vecs = json.load(open(vecs_file))
+  data = json.load(open(data_file, encoding='utf-8'))
+  vecs = load_vecs(vecs_file)
   res = {}
   for doc_id in data:
     word_vecs = [vecs[w] for w in data[doc_id]]
@@ -48,8 +85,81 @@ def apply_sum(data_file, vecs_file, dump_file):
   json.dump(res, open(dump_file, 'w'))
 
 
+def apply_sum_matrix(data_file, vecs_file, dump_prefix, mode='sum',
+    chunk_size=10000, dtype='float32'):
+  """ Vectorized version of apply_sum(). The words of each document are mapped
+  to rows of the embedding matrix and the vectors of a chunk of documents are
+  added at once with np.add.reduceat over the flat array of rows. The result
+  is a matrix with one row per document, dumped to '{dump_prefix}.npy', and
+  the IDs of the documents in the same order, dumped to '{dump_prefix}.ids.txt'
+  (see load_doc_vecs). Documents without data are skipped, as in apply_sum().
+  The documents are streamed from the data file (see json_stream) one chunk
+  at a time, so that it isn't loaded into memory, and the rows of each chunk
+  are appended to a temporary file, which is copied to the .npy file once
+  the no. of documents is known.
+  mode (str): 'sum' adds the word vectors, 'mean' averages them and 'log_tf'
+    adds the vectors of the distinct words of each document, weighted by
+    1 + log(tf), where tf is the no. of times the word occurs in the doc.
+  chunk_size (int): no. of documents whose vectors are computed at once. """
+  idx, matrix = load_matrix(vecs_file)
+  rows_file = f'{dump_prefix}.rows.tmp'
+  n_docs, items = 0, iter_items(data_file)
+  with open(rows_file, 'wb') as rows_f, \
+      open(f'{dump_prefix}.ids.txt.tmp', 'w', encoding='utf-8') as ids_f:
+    while True:
+      chunk = list(islice(items, chunk_size))
+      if len(chunk) == 0:
+        break
+      for doc_id, words in chunk:
+        if len(words) == 0:
+          print(doc_id + " has no data")
+      chunk = [(doc_id, words) for doc_id, words in chunk if len(words) > 0]
+      if len(chunk) == 0:
+        continue
+      sums = sum_chunk([words for _, words in chunk], idx, matrix, mode)
+      rows_f.write(sums.astype(dtype).tobytes())
+      for doc_id, _ in chunk:
+        ids_f.write(doc_id + '\n')
+      n_docs += len(chunk)
+  res = np.lib.format.open_memmap(
+    f'{dump_prefix}.npy', mode='w+', dtype=dtype,
+    shape=(n_docs, matrix.shape[1])
+  )
+  if n_docs > 0:
+    rows = np.memmap(rows_file, dtype=dtype, mode='r', shape=res.shape)
+    for start in range(0, n_docs, chunk_size):
+      res[start:start+chunk_size] = rows[start:start+chunk_size]
+    del rows
+  res.flush()
+  os.remove(rows_file)
+  os.replace(f'{dump_prefix}.ids.txt.tmp', f'{dump_prefix}.ids.txt')
+
+
+def sum_chunk(docs, idx, matrix, mode):
+  """ Return the matrix with the vectors of the given lists of words, which
+  must not be empty (see apply_sum_matrix). """
+  lens = np.array([len(words) for words in docs])
+  rows = np.fromiter(
+    (idx[w] for words in docs for w in words), dtype=np.int64,
+    count=lens.sum()
+  )
+  if mode == 'log_tf':  # distinct (doc, word) pairs, sorted by doc
+    doc_nrs = np.repeat(np.arange(len(docs)), lens)
+    keys, tf = np.unique(doc_nrs * len(matrix) + rows, return_counts=True)
+    doc_nrs, rows = keys // len(matrix), keys % len(matrix)
+    vecs = matrix[rows] * (1 + np.log(tf))[:, None]
+    starts = np.flatnonzero(np.diff(doc_nrs, prepend=-1))
+  else:
+    vecs = np.asarray(matrix[rows], dtype=np.float64)
+    starts = np.concatenate([[0], np.cumsum(lens)[:-1]])
+  sums = np.add.reduceat(vecs, starts, axis=0)
+  if mode == 'mean':
+    sums /= lens[:, None]
+  return sums
+
+
 if __name__ == '__main__':
   vecs_file = 'data/vecs/embeddings.json'
   data_file = f'data/bow/docs.json'
   dump_file = f'data/vecs/docs_sum.json'
-  apply_sum(data_file, vecs_file, dump_file)
\ No newline at end of file
+  apply_sum(data_file, vecs_file, dump_file)
@@ -6,9 +6,24 @@ computed by represent_docs.py.
 We first compute distances with fields, and then for all their descendants
 if the distance between field and doc surpasses a threshold. Another threshold
 is used to determine if a subject is assigned to a doc. 
+
+When docs and subjects are represented by single vectors (cos_sum), the
+distances are computed for blocks of docs at once: both matrices are
+L2-normalized, so that the cosine similarities of a block are a single matrix
+product, and the closest subjects are selected with np.argpartition. The
+summed doc vectors can also be stored in float16 or int8 (see quantized.py),
+in which case each block of docs is converted to float32 when it is compared;
+this reduces the memory, not the time of the products. The padded subjects of
+the sequences can be quantized in the same way (see quantize_subjects), and
+the word vectors of the docs in the SequenceStore that holds them.
+Sequences of word vectors (cos_avg, cos_concat) are padded with zeros into 3D
+arrays, so that the products of each position are also matrix products; the
+zero padding cancels the positions beyond the shorter sequence of each pair.
 """
 
 
+from os import makedirs, path, remove, replace
+from time import perf_counter
 import json
 from itertools import islice
 
@@ -16,6 +31,8 @@ from scipy.spatial.distance import cosine
 import numpy as np
 
 from retrieve_docs import DocRetriever
+from apply_embeddings import load_doc_vecs
+from quantized import QuantizedMatrix, quantize, quantize_rows, load_quantized
 
 
 def cos_avg(vec1, vec2):
@@ -53,74 +70,576 @@ def cos_sum(vec1, vec2):
   return cosine(vec1, vec2)
 
 
-def compute_distances(docs, subjects, func):
-  """ Compute distances between docs and subjects. Return them ordered by
-  distance, with the smallest one first. """
-  dists = {}
-  for doc, vec in docs.items():
-    dists[doc] = {}
-    for subject in subjects:
-      dists[doc][subject] = func(vec, subjects[subject])
-    dists[doc] = dict(sorted(dists[doc].items(), key=lambda t: t[1]))
+def normalize(matrix):
+  """ Return the rows of the matrix divided by their L2 norms. Rows whose
+  norm is zero are left as they are. """
+  matrix = np.asarray(matrix, dtype=np.float32)
+  norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+  return matrix / np.where(norms > 0, norms, 1)
+
+
+def cosine_topk(docs, subjects, n=None, chunk_size=1024, masks=None):
+  """ Yield the n subjects that are closest to each doc and their cosine
+  distances, for blocks of 'chunk_size' docs. Each block is a tuple with the
+  index of its first doc, the indices of the subjects (chunk_size x n) and
+  their distances, ordered by distance, with the smallest one first.
+  docs, subjects (arrays): L2-normalized matrices (see normalize()).
+  n (int): no. of subjects per doc; if None, all subjects are returned.
+  masks (function): optional function that receives the index of the first
+    and the last doc of a block and returns a boolean matrix that marks the
+    candidate subjects of each doc. Other subjects are never selected; if a
+    doc has less than n candidates, the remaining ones get infinite
+    distances. """
+  for start in range(0, len(docs), chunk_size):
+    end = min(start + chunk_size, len(docs))
+    dists = 1 - np.asarray(docs[start:end]) @ subjects.T
+    if masks is not None:
+      dists[~masks(start, end)] = np.inf
+    yield (start, *select_topk(dists, n))
+
+
+def select_topk(dists, n=None):
+  """ Return the indices of the n smallest distances of each row of the
+  matrix and the distances, ordered by distance. If n is None, all columns
+  are returned. """
+  n = dists.shape[1] if n is None else min(n, dists.shape[1])
+  if n < dists.shape[1]:
+    idx = np.argpartition(dists, n-1, axis=1)[:, :n]
+  else:
+    idx = np.broadcast_to(np.arange(n), dists.shape)
+  top = np.take_along_axis(dists, idx, axis=1)
+  order = np.argsort(top, axis=1, kind='stable')
+  return (np.take_along_axis(idx, order, axis=1),
+    np.take_along_axis(top, order, axis=1))
+
+
+def pad(seqs, max_len=None):
+  """ Stack sequences of word vectors into an array of shape (no. of
+  sequences, max_len, n_dims), filling the missing positions with zeros, and
+  return it with the lengths of the sequences. Longer sequences are truncated
+  to max_len, which defaults to the length of the longest sequence. """
+  lens = np.array([len(seq) for seq in seqs], dtype=np.int64)
+  if max_len is None:
+    max_len = int(lens.max()) if len(lens) > 0 else 0
+  n_dims = next((len(seq[0]) for seq in seqs if len(seq) > 0), 1)
+  padded = np.zeros((len(seqs), max_len, n_dims), dtype=np.float32)
+  for i, seq in enumerate(seqs):
+    if lens[i] > 0:
+      padded[i, :min(lens[i], max_len)] = np.asarray(seq)[:max_len]
+  return padded, lens
+
+
+def seq_distances(docs, doc_lens, subjects, subject_lens, func, norms):
+  """ Compute the distances of cos_avg or cos_concat between all docs and
+  subjects at once. Both are padded arrays as returned by pad(), and the
+  subjects and their norms must have been prepared with prepare_subjects()
+  (or quantize_subjects(), whose subjects are read one position at a time).
+  The result is a matrix of shape (no. of docs, no. of subjects). Each pair is
+  truncated to its shorter sequence, as the reference functions do, and
+  their edge cases are kept: the distance is zero if the doc is empty or the
+  subject has one word. Pairs with an empty subject, where the reference
+  functions fail, get infinite distances, so that they are never selected.
+  Word vectors with zero norm count as orthogonal to any other. """
+  max_len = min(docs.shape[1], subjects.shape[1])
+  docs = docs[:, :max_len]
+  lens = np.minimum(doc_lens[:, None], subject_lens[None])
+  if func is cos_avg:
+    docs = normalize_words(docs)
+  dots = np.zeros(lens.shape, dtype=np.float32)
+  for i in range(max_len):
+    dots += docs[:, i] @ subjects[:, i].T
+  with np.errstate(divide='ignore', invalid='ignore'):
+    if func is cos_avg:
+      dists = 1 - dots / lens
+    else:
+      doc_norms = np.cumsum((docs ** 2).sum(2), axis=1)
+      last = np.maximum(lens, 1) - 1
+      dists = 1 - dots / np.sqrt(
+        np.take_along_axis(doc_norms, last, axis=1)
+        * np.take_along_axis(norms, last.T, axis=1).T
+      )
+  dists[lens == 0] = np.inf
+  dists[(doc_lens[:, None] == 0) | (subject_lens[None] == 1)] = 0
   return dists
 
 
-def find_fields(dump_file, func):
+def normalize_words(seqs):
+  """ Return the padded sequences with each word vector divided by its L2
+  norm. Padding and vectors whose norm is zero are left as they are. """
+  norms = np.linalg.norm(seqs, axis=2, keepdims=True)
+  return seqs / np.where(norms > 0, norms, 1)
+
+
+def prepare_subjects(subjects, func):
+  """ Return the padded subjects as seq_distances() expects them, with their
+  word vectors normalized for cos_avg, and the cumulative squared norms of
+  their word vectors (no. of subjects x max. length), which cos_concat uses.
+  Both only depend on the subjects, so that they are computed once for all
+  blocks of docs. """
+  if func is cos_avg:
+    subjects = normalize_words(subjects)
+  return subjects, np.cumsum((subjects ** 2).sum(2), axis=1)
+
+
+def quantize_subjects(subjects, func, dtype=None):
+  """ Prepare the padded subjects (see prepare_subjects) and, if dtype
+  ('float16' or 'int8') is given, quantize them with a scale per word
+  vector. seq_distances() reads them one position at a time, so that only
+  the vectors of that position are converted to float32. The norms are those
+  of the float32 subjects. """
+  subjects, norms = prepare_subjects(subjects, func)
+  if dtype is not None:
+    subjects = quantize(subjects, dtype)
+  return subjects, norms
+
+
+def seq_topk(docs, subjects, subject_lens, func, n=None, chunk_size=256,
+    masks=None, norms=None):
+  """ Yield blocks of the n closest subjects of each doc, as cosine_topk()
+  does, with the distances of seq_distances().
+  docs (list): sequences of word vectors.
+  subjects, subject_lens (arrays): padded subjects, as returned by pad().
+  func (function): cos_avg or cos_concat.
+  masks (function): marks the candidate subjects (see cosine_topk).
+  norms (array): norms returned by prepare_subjects(). If given, the subjects
+    are assumed to be prepared as well; otherwise both are prepared here. """
+  if norms is None:
+    subjects, norms = prepare_subjects(subjects, func)
+  for start in range(0, len(docs), chunk_size):
+    end = min(start + chunk_size, len(docs))
+    block, doc_lens = pad(docs[start:end], subjects.shape[1])
+    dists = seq_distances(block, doc_lens, subjects, subject_lens, func, norms)
+    if masks is not None:
+      dists[~masks(start, end)] = np.inf
+    yield (start, *select_topk(dists, n))
+
+
+def topk_items(doc_ids, subject_ids, blocks):
+  """ Convert the blocks yielded by cosine_topk() into tuples with a doc and
+  its distances as a dict, leaving out infinite distances. """
+  for start, idx, top in blocks:
+    for i in range(len(idx)):
+      yield doc_ids[start+i], {
+        subject_ids[j]: float(d) for j, d in zip(idx[i], top[i])
+        if d != np.inf
+      }
+
+
+def topk_dict(doc_ids, subject_ids, blocks):
+  """ Return the dict of compute_distances() for the blocks yielded by
+  cosine_topk(). """
+  return dict(topk_items(doc_ids, subject_ids, blocks))
+
+
+def get_field_rows(subject_ids):
+  """ Return a dict that maps each field to an array with the rows of its
+  descendants in the list of subject IDs. """
+  field_subjects = json.load(open('data/openalex/field_subjects.json'))
+  subject_rows = {id: i for i, id in enumerate(subject_ids)}
+  return {
+    field: np.array([subject_rows[id] for id in ids if id in subject_rows],
+      dtype=np.int64)
+    for field, ids in field_subjects.items()
+  }
+
+
+def candidate_rows(field_rows, fields, n_fields):
+  """ Return the rows of the descendants of the first n_fields fields, once
+  each, as subjects may descend from several of them. """
+  return np.unique(np.concatenate(
+    [field_rows[field] for field in list(fields)[:n_fields]]
+  ))
+
+
+def field_masks(doc_ids, fields, field_rows, n_subjects, n_fields):
+  """ Return a masks function for cosine_topk() and seq_topk(), which marks
+  the descendants of the first n_fields fields of each doc of a block.
+  fields (dict): closest fields of each doc, as dumped by find_fields(). """
+  def masks(start, end):
+    mask = np.zeros((end-start, n_subjects), dtype=bool)
+    for i, doc in enumerate(doc_ids[start:end]):
+      mask[i, candidate_rows(field_rows, fields[doc], n_fields)] = True
+    return mask
+  return masks
+
+
+def file_signature(files):
+  """ Return the size and the modification time of each file, which change
+  whenever a file is written again. """
+  return {file: [path.getsize(file), path.getmtime(file)] for file in files}
+
+
+def read_done(jsonl_file, key):
+  """ Return the docs that are already present in the JSON-lines file, which
+  is created if it doesn't exist. The first line of the file holds the key
+  of the run that wrote it (its parameters and the signatures of its
+  inputs); if it differs from the given key, the file is emptied, so that
+  only an interrupted run with the same key is resumed. A line that was cut
+  by an interruption is removed, so that new lines can be appended. """
+  key_line = (json.dumps({'key': key}) + '\n').encode('utf-8')
+  done, valid = set(), 0
+  if path.exists(jsonl_file):
+    with open(jsonl_file, 'rb') as f:
+      if f.readline() == key_line:
+        valid = len(key_line)
+        for line in f:
+          if not line.endswith(b'\n'):
+            break
+          done.update(json.loads(line))
+          valid += len(line)
+  with open(jsonl_file, 'ab') as f:
+    f.truncate(valid)
+    if valid == 0:
+      f.write(key_line)
+  return done
+
+
+def collect(jsonl_file, dump_file):
+  """ Merge the lines of the JSON-lines file, after its key, into one dict
+  and dump it. The JSON-lines file is removed once the dump is complete, so
+  that the next run starts from scratch. """
+  res = {}
+  with open(jsonl_file) as f:
+    next(f)
+    for line in f:
+      res.update(json.loads(line))
+  json.dump(res, open(f'{dump_file}.tmp', 'w'))
+  replace(f'{dump_file}.tmp', dump_file)
+  remove(jsonl_file)
+
+
+def compute_distances(docs, subjects, func, n=None, chunk_size=256,
+    dtype=None):
+  """ Compute distances between docs and subjects. Return them ordered by
+  distance, with the smallest one first. If n is given, only the n closest
+  subjects of each doc are returned. The distances of cos_sum, cos_avg and
+  cos_concat are computed with matrix products (see cosine_topk and
+  seq_topk), for blocks of chunk_size docs. The docs are read one block at a
+  time from docs.items(), so that a DocRetriever is streamed. dtype
+  quantizes the prepared subjects of cos_avg and cos_concat (see
+  quantize_subjects). """
+  subject_ids, subject_vecs = list(subjects.keys()), list(subjects.values())
+  if func is cos_sum:
+    subject_vecs = normalize(subject_vecs)
+  elif func in (cos_avg, cos_concat):
+    padded, lens = pad(subject_vecs)
+    padded, norms = quantize_subjects(padded, func, dtype)
+  else:
+    dists = {}
+    for doc, vec in docs.items():
+      dists[doc] = {}
+      for subject in subjects:
+        dists[doc][subject] = func(vec, subjects[subject])
+      dists[doc] = dict(islice(
+        sorted(dists[doc].items(), key=lambda t: t[1]), n
+      ))
+    return dists
+  dists, items = {}, iter(docs.items())
+  while True:
+    block = list(islice(items, chunk_size))
+    if len(block) == 0:
+      return dists
+    doc_ids, doc_vecs = zip(*block)
+    if func is cos_sum:
+      blocks = cosine_topk(normalize(doc_vecs), subject_vecs, n, chunk_size)
+    else:
+      blocks = seq_topk(
+        doc_vecs, padded, lens, func, n, chunk_size, norms=norms
+      )
+    dists.update(topk_items(doc_ids, subject_ids, blocks))
+
+
+def find_fields(dump_file, func, dtype=None):
   """ Compute distances between docs and fields, and pick the top three for
-  each document. """
+  each document. dtype quantizes the subjects (see quantize_subjects). """
   docs = DocRetriever()
   subjects = json.load(open('data/vecs/subjects.json'))
   subject_info = json.load(open('data/openalex/subjects.json'))
   l0_ids = [id for id, data in subject_info.items() if data['level'] == 0]
   l0_subjects = {id: vec for id, vec in subjects.items() if id in l0_ids}
-  dists = compute_distances(docs, l0_subjects, func)
+  dists = compute_distances(docs, l0_subjects, func, dtype=dtype)
   json.dump(dists, open(dump_file, 'w'))
 
 
-def find_subjects(folder, func, n_fields=3, n=50):
+def find_subjects(folder, func, n_fields=3, n=50, batch_size=1000,
+    chunk_size=256, dtype=None):
   """ Once the fields have been found, compare the docs with all subjects
   under each of the found fields and keep the top n. n_fields determines
   the descendants of how many fields are evaluated, starting with
-  the one with the smallest distance to the document. """
+  the one with the smallest distance to the document. The subjects are
+  padded once; the distances of a block of chunk_size docs to all of them
+  are computed at once (see seq_topk), and the subjects that don't descend
+  from the doc's fields are masked out. Each doc is written to a JSON-lines
+  file as soon as its batch is done; docs that are already in that file are
+  skipped, so that an interrupted run can be resumed if its parameters and
+  inputs are the same (see read_done). When all docs are done, the lines are
+  merged into the JSON file and the JSON-lines file is removed. The vectors
+  of the docs are retrieved in batches of 'batch_size' docs.
+  func (function): cos_avg or cos_concat; cos_sum is computed by
+    find_subjects_sum().
+  dtype (str): quantizes the subjects (see quantize_subjects). """
+  if func not in (cos_avg, cos_concat):
+    raise ValueError('find_subjects() supports cos_avg and cos_concat')
   dump_file = f'data/distances/{folder}/top_50_subjects.json'
+  jsonl_file = f'data/distances/{folder}/top_50_subjects.jsonl'
   docs = DocRetriever()
   subjects = json.load(open('data/vecs/subjects.json'))
-  field_subjects = json.load(open('data/openalex/field_subjects.json'))
-  fields_dists = json.load(open(f'data/distances/{folder}/l0_distances.json'))
-  best_subjects = {}
-  for doc, fields in fields_dists.items():
-    for field in list(fields.keys())[:n_fields]:
-      candidates = {id: vec for id, vec in subjects.items() if id in
-        field_subjects[field]}
-      dists = compute_distances({doc: docs.get_vec(doc)}, candidates, func)[doc]
-      best_subjects[doc] = dict(islice(dists.items(), n))
-    json.dump(best_subjects, open(dump_file, 'w'))
-  json.dump(best_subjects, open(dump_file, 'w'))
-
-
-def find_subjects_sum(n_fields=5, n=20):
+  subject_ids = list(subjects.keys())
+  padded, lens = pad(list(subjects.values()))
+  padded, norms = quantize_subjects(padded, func, dtype)
+  field_rows = get_field_rows(subject_ids)
+  fields_file = f'data/distances/{folder}/l0_distances.json'
+  fields_dists = json.load(open(fields_file))
+  done = read_done(jsonl_file, {
+    'func': func.__name__, 'n': n, 'n_fields': n_fields, 'dtype': dtype,
+    'inputs': file_signature([
+      'data/vecs/subjects.json', 'data/openalex/field_subjects.json',
+      fields_file
+    ]),
+    'docs': docs.signature(),
+  })
+  pending = [doc for doc in fields_dists if doc not in done]
+  with open(jsonl_file, 'a') as f:
+    for start in range(0, len(pending), batch_size):
+      vecs = docs.get_vecs(pending[start:start+batch_size])
+      doc_ids, doc_vecs = list(vecs.keys()), list(vecs.values())
+      masks = field_masks(
+        doc_ids, fields_dists, field_rows, len(subject_ids), n_fields
+      )
+      blocks = seq_topk(
+        doc_vecs, padded, lens, func, n, chunk_size, masks, norms
+      )
+      for doc, dists in topk_items(doc_ids, subject_ids, blocks):
+        f.write(json.dumps({doc: dists}) + '\n')
+      f.flush()
+  collect(jsonl_file, dump_file)
+
+
+def load_docs_sum():
+  """ Return the IDs and the matrix of the summed doc vectors. They are read
+  from the matrix dumped by apply_embeddings.apply_sum_matrix() if it exists,
+  and otherwise from the JSON file dumped by apply_sum(). """
+  if path.exists('data/vecs/docs_sum.npy'):
+    return load_doc_vecs('data/vecs/docs_sum')
+  docs = json.load(open('data/vecs/docs_sum.json'))
+  return list(docs.keys()), np.array(list(docs.values()))
+
+
+def load_subjects_sum():
+  """ Return the IDs of the subjects and the matrix of their summed word
+  vectors. Subjects without words are represented by zero vectors. """
+  subjects = json.load(open('data/vecs/subjects.json'))
+  n_dims = max(len(vec[0]) for vec in subjects.values() if len(vec) > 0)
+  matrix = np.zeros((len(subjects), n_dims), dtype=np.float32)
+  for i, vec in enumerate(subjects.values()):
+    if len(vec) > 0:
+      matrix[i] = np.array(vec).sum(0)
+  return list(subjects.keys()), matrix
+
+
+def docs_sum_files():
+  """ Return the files from which load_docs_sum() reads the summed doc
+  vectors. """
+  if path.exists('data/vecs/docs_sum.npy'):
+    return ['data/vecs/docs_sum.npy', 'data/vecs/docs_sum.ids.txt']
+  return ['data/vecs/docs_sum.json']
+
+
+def load_normalized_sum(dtype=None):
+  """ Return the IDs and the L2-normalized summed vectors of the docs and the
+  subjects. If dtype ('float16' or 'int8') is given, the docs are read from
+  the quantized matrix 'data/vecs/quantized/docs_sum_{dtype}', outside the
+  folder read by DocRetriever, and the subjects are quantized as well, so
+  that the distances are those of the quantized vectors. The quantized
+  matrix is created from the summed vectors when it is missing or when they
+  changed, which is determined by the size and the modification time of
+  their files, stored in '{prefix}.source.json'. That
+  file is written last, so that an interrupted run creates the matrix again.
+  """
+  subject_ids, subjects = load_subjects_sum()
+  if dtype is None:
+    doc_ids, docs = load_docs_sum()
+    return doc_ids, normalize(docs), subject_ids, normalize(subjects)
+  makedirs('data/vecs/quantized', exist_ok=True)
+  prefix = f'data/vecs/quantized/docs_sum_{dtype}'
+  source_file = f'{prefix}.source.json'
+  source = file_signature(docs_sum_files())
+  if path.exists(source_file) and json.load(open(source_file)) == source:
+    with open(f'{prefix}.ids.txt', encoding='utf-8') as f:
+      doc_ids = f.read().split('\n')[:-1]
+    docs = load_quantized(prefix)
+  else:
+    if path.exists(source_file):
+      remove(source_file)
+    doc_ids, docs = load_docs_sum()
+    with open(f'{prefix}.ids.txt.tmp', 'w', encoding='utf-8') as f:
+      for id in doc_ids:
+        f.write(id + '\n')
+    replace(f'{prefix}.ids.txt.tmp', f'{prefix}.ids.txt')
+    docs = quantize_rows(docs, dtype, prefix, normalize)
+    json.dump(source, open(f'{source_file}.tmp', 'w'))
+    replace(f'{source_file}.tmp', source_file)
+  return doc_ids, docs, subject_ids, quantize(normalize(subjects), dtype)[:]
+
+
+def find_fields_sum(dump_file, chunk_size=1024, dtype=None):
+  """ Compute distances between the summed vectors of docs and fields, as
+  find_fields() does with cos_sum, for blocks of docs at once. dtype selects
+  quantized vectors (see load_normalized_sum). """
+  doc_ids, docs, subject_ids, subjects = load_normalized_sum(dtype)
+  subject_info = json.load(open('data/openalex/subjects.json'))
+  rows = [i for i, id in enumerate(subject_ids)
+    if subject_info[id]['level'] == 0]
+  l0_ids = [subject_ids[i] for i in rows]
+  blocks = cosine_topk(docs, subjects[rows], chunk_size=chunk_size)
+  json.dump(topk_dict(doc_ids, l0_ids, blocks), open(dump_file, 'w'))
+
+
+def find_subjects_sum(n_fields=5, n=20, chunk_size=1024, dtype=None):
   """ Once the fields have been found, compare the docs with all subjects
   under each of the found fields and keep the top n. n_fields determines
   the descendants of how many fields are evaluated, starting with
-  the one with the smallest distance to the document. """
+  the one with the smallest distance to the document. The distances of a
+  block of docs to all subjects are computed with one matrix product, and
+  the subjects that don't descend from the doc's fields are masked out. As in
+  find_subjects(), the results are written to a JSON-lines file after each
+  block and docs that are already there are skipped, if the file was written
+  by an interrupted run with the same parameters. dtype selects quantized
+  vectors (see load_normalized_sum). """
   dump_file = f'data/distances/sum/top_50_subjects.json'
-  docs = json.load(open('data/vecs/docs_sum.json'))
-  docs = {doc_id: np.array(vec) for doc_id, vec in docs.items()}
+  jsonl_file = f'data/distances/sum/top_50_subjects.jsonl'
+  doc_ids, docs, subject_ids, subjects = load_normalized_sum(dtype)
+  field_rows = get_field_rows(subject_ids)
+  fields_file = 'data/distances/sum/l0_distances.json'
+  fields_dists = json.load(open(fields_file))
+  done = read_done(jsonl_file, {
+    'n': n, 'n_fields': n_fields, 'dtype': dtype,
+    'inputs': file_signature(docs_sum_files() + [
+      'data/vecs/subjects.json', 'data/openalex/field_subjects.json',
+      fields_file
+    ]),
+  })
+  rows = [  # docs without data are not vectorized
+    i for i, doc in enumerate(doc_ids) if doc in fields_dists
+    and doc not in done
+  ]
+  doc_ids = [doc_ids[i] for i in rows]
+  docs = docs.take(rows) if isinstance(docs, QuantizedMatrix) else docs[rows]
+
+  masks = field_masks(
+    doc_ids, fields_dists, field_rows, len(subject_ids), n_fields
+  )
+  blocks = cosine_topk(docs, subjects, n, chunk_size, masks)
+  with open(jsonl_file, 'a') as f:
+    for doc, dists in topk_items(doc_ids, subject_ids, blocks):
+      f.write(json.dumps({doc: dists}) + '\n')
+  collect(jsonl_file, dump_file)
+
+
+def quantization_report(dtype, func=cos_sum, n=20, n_docs=1000,
+    dump_file=None, seed=0):
+  """ Compare the closest subjects of a random sample of docs computed with
+  quantized vectors to those computed with float32 vectors, and return (and
+  optionally dump) the results: the avg. share of the n closest subjects
+  that are found with quantized vectors (recall), how often the closest
+  subject is the same, the mean and max. absolute error of the distances,
+  the memory of the quantized matrix and of its float32 version and the time
+  taken by the distances.
+  func (function): cos_sum compares the summed vectors (see report_sum),
+    cos_avg and cos_concat the sequences of word vectors (see report_seqs).
+  The quantized values are converted to float32 before the products, as
+  numpy has no fast float16 or int8 products, so that the times are similar;
+  only the memory is reduced. """
+  rng = np.random.default_rng(seed)
+  if func is cos_sum:
+    exact, quant, distances = report_sum(dtype, n_docs, rng)
+  else:
+    exact, quant, distances = report_seqs(dtype, func, n_docs, rng)
+  results = {}
+  for name, (docs, subjects, _) in [('float32', exact), (dtype, quant)]:
+    start = perf_counter()
+    dists = distances(docs, subjects)
+    results[name] = (perf_counter() - start, dists, select_topk(dists, n)[0])
+  _, exact_dists, top_exact = results['float32']
+  _, quant_dists, top_quant = results[dtype]
+  recall = np.mean([
+    len(set(top_exact[i]) & set(top_quant[i])) / top_exact.shape[1]
+    for i in range(len(top_exact))
+  ])
+  finite = np.isfinite(exact_dists)  # pairs with empty subjects are inf
+  errors = np.abs(exact_dists[finite] - quant_dists[finite])
+  report = {
+    'dtype': dtype,
+    'func': func.__name__,
+    'n': n,
+    'n_docs': len(top_exact),
+    'recall': float(recall),
+    'top1_agreement': float(np.mean(top_exact[:, 0] == top_quant[:, 0])),
+    'mean_abs_error': float(errors.mean()),
+    'max_abs_error': float(errors.max()),
+    'float32_mb': exact[2] / 2**20,
+    f'{dtype}_mb': quant[2] / 2**20,
+    'float32_seconds': results['float32'][0],
+    f'{dtype}_seconds': results[dtype][0],
+  }
+  if dump_file is not None:
+    json.dump(report, open(dump_file, 'w'), indent=2)
+  return report
+
+
+def report_sum(dtype, n_docs, rng):
+  """ Return the inputs of quantization_report() for the summed vectors: the
+  float32 and the quantized docs of a sample and the subjects, each with the
+  size of the whole doc matrix in bytes, and the function that computes
+  their distances. """
+  doc_ids, exact, _, exact_subjects = load_normalized_sum()
+  quant_ids, quant, _, quant_subjects = load_normalized_sum(dtype)
+  rows = np.sort(rng.choice(len(doc_ids), min(n_docs, len(doc_ids)), False))
+  quant_idx = {id: i for i, id in enumerate(quant_ids)}
+  quant_rows = [quant_idx[doc_ids[i]] for i in rows]
+
+  def distances(docs, subjects):
+    return 1 - docs[:] @ subjects.T
+
+  return (
+    (exact[rows], exact_subjects, exact.nbytes),
+    (quant.take(quant_rows), quant_subjects, quant.nbytes),
+    distances,
+  )
+
+
+def report_seqs(dtype, func, n_docs, rng, chunk_size=256):
+  """ Return the inputs of quantization_report() for sequences of word
+  vectors, as report_sum() does. The docs of the sample are quantized per
+  word vector, as SequenceStore stores them when it is materialized with the
+  dtype, and the prepared subjects as find_subjects() does with the dtype.
+  The sizes are those of the padded subjects. """
+  docs = DocRetriever()
+  doc_ids = sorted(docs.ids)
+  sample = rng.choice(len(doc_ids), min(n_docs, len(doc_ids)), False)
+  exact = [
+    np.asarray(vec, dtype=np.float32)
+    for vec in docs.get_vecs([doc_ids[i] for i in np.sort(sample)]).values()
+  ]
+  quant = [quantize(vec, dtype)[:] if len(vec) > 0 else vec for vec in exact]
   subjects = json.load(open('data/vecs/subjects.json'))
-  subjects = {doc_id: np.array(vec).sum(0) for doc_id, vec in subjects.items()}
-  field_subjects = json.load(open('data/openalex/field_subjects.json'))
-  fields_dists = json.load(open(f'data/distances/sum/l0_distances.json'))
-  best_subjects = {}
-  for doc, fields in fields_dists.items():
-    if doc not in docs:  # docs without data are not vectorized
-      continue
-    for field in list(fields.keys())[:n_fields]:
-      candidates = {id: vec for id, vec in subjects.items() if id in
-        field_subjects[field]}
-      dists = compute_distances({doc: docs[doc]}, candidates, cos_sum)[doc]
-      best_subjects[doc] = dict(islice(dists.items(), n))
-    json.dump(best_subjects, open(dump_file, 'w'))
-  json.dump(best_subjects, open(dump_file, 'w'))
+  padded, lens = pad(list(subjects.values()))
+  padded, norms = prepare_subjects(padded, func)
+  quant_subjects = quantize(padded, dtype)
+
+  def distances(docs, subjects):
+    return np.concatenate([
+      seq_distances(
+        *pad(docs[start:start+chunk_size], subjects.shape[1]), subjects,
+        lens, func, norms
+      ) for start in range(0, len(docs), chunk_size)
+    ])
+
+  return (
+    (exact, padded, padded.nbytes),
+    (quant, quant_subjects, quant_subjects.nbytes),
+    distances,
+  )
 
 
 def sort_subjects():
@@ -0,0 +1,2 @@
+""" Benchmarks for the performance-critical parts of the project. Each module
+can be run on its own, e.g. 'python -m benchmarks.sampler'. """
@@ -0,0 +1,54 @@
+""" Compare the throughput of the negative sampler with the implementation it
+replaced, which built the population and its weights for every center word and
+then called random.choices(). A Zipfian vocabulary is used, as the frequencies
+of real words follow Zipf's law. """
+
+
+from random import choices
+from time import perf_counter
+import json
+
+import numpy as np
+
+from skipgram.sampler import Sampler
+
+
+def zipf_freqs(n_words, power=.75):
+  """ Return the unigram frequencies of a Zipfian vocabulary with n_words,
+  raised to the given power and normalized, as done by utils.compute_freqs. """
+  freqs = (1 / np.arange(1, n_words+1)) ** power
+  return freqs / freqs.sum()
+
+
+def sample_choices(freqs, exclude, n):
+  """ Previous implementation of Dataset.sample(). """
+  population = list(set(range(len(freqs))) - set(exclude))
+  weights = [freqs[i] for i in population]
+  return choices(population, weights, k=n)
+
+
+def run(n_words=100000, n_neg=15, window=3, duration=2):
+  """ Draw the negative samples of as many center words as possible during
+  'duration' seconds with both implementations and return the no. of
+  negative samples drawn per second by each of them. """
+  freqs = zipf_freqs(n_words)
+  rng = np.random.default_rng(0)
+  sampler = Sampler(freqs, rng)
+  n = n_neg * window * 2
+  res = {}
+  for name, func in [
+      ('choices', lambda ex: sample_choices(freqs.tolist(), ex, n)),
+      ('sampler', lambda ex: sampler.sample(n, ex)),
+      ('sampler_batch', lambda ex: sampler.sample_batch(
+        window*2, n_neg, np.repeat([ex[:2]], window*2, axis=0)
+      ))]:
+    cnt, start = 0, perf_counter()
+    while perf_counter() - start < duration:
+      func(rng.integers(0, n_words, window*2+1).tolist())
+      cnt += n
+    res[name] = cnt / (perf_counter() - start)
+  return res
+
+
+if __name__ == '__main__':
+  print(json.dumps(run(), indent=2))
@@ -0,0 +1,269 @@
+""" Benchmark the main stages of the project on a synthetic dataset (see
+benchmarks.synthetic) and dump the results to a JSON file, named after the
+current commit, so that the results of two commits can be compared with
+compare(). Micro-benchmarks repeat a small operation (a training step, a
+look-up) and report its throughput; macro-benchmarks run a whole stage over
+the synthetic dataset. Each benchmark is run 'repeat' times and the fastest
+run is reported, as it is the least disturbed by other processes.
+
+Run all benchmarks with 'python -m benchmarks.suite', or some of them with
+'python -m benchmarks.suite dataset skipgram'. Compare two result files with
+'python -m benchmarks.suite --compare old.json new.json'. """
+
+
+from os import makedirs, path, remove
+from time import perf_counter, strftime
+import json
+import platform
+import subprocess
+import sys
+import tempfile
+
+import numpy as np
+import torch
+
+from apply_embeddings import apply_sum, apply_sum_matrix
+from assign_subjects import compute_distances, cos_sum, cos_avg, cos_concat
+from benchmarks.synthetic import generate, working_dir
+from represent_docs import Representer
+from retrieve_docs import DocRetriever
+from skipgram.load_data import Dataset, BatchDataset
+from skipgram.model import Skipgram
+from venue_ert import create_ert
+
+
+VOCAB_FILE = 'data/vocab/vocab_freqs.json'
+DATA_FILE = 'data/json/dim/all/data_lemmas_vocab.json'
+
+
+def best_time(func, repeat):
+  """ Call the function 'repeat' times and return the shortest duration in
+  seconds and the result of the last call. """
+  times = []
+  for _ in range(repeat):
+    start = perf_counter()
+    res = func()
+    times.append(perf_counter() - start)
+  return min(times), res
+
+
+def bench_dataset(repeat):
+  """ Iterate over one epoch of the TXT file and of the encoded corpus. """
+  res = {}
+  for name, make in [
+      ('txt', lambda: Dataset(VOCAB_FILE, 'data/txt/data_lemmas.txt', seed=0)),
+      ('corpus', lambda: Dataset(VOCAB_FILE, 'data/txt/data_lemmas', seed=0)),
+      ('batched', lambda: BatchDataset(
+        VOCAB_FILE, 'data/txt/data_lemmas', 15, 2, 1e-5, seed=0
+      ))]:
+    dataset = make()
+    seconds, n_pairs = best_time(
+      lambda: sum(len(item[0]) if dataset.batched else 1 for item in dataset),
+      repeat
+    )
+    res[name] = {'seconds': seconds, 'pairs_per_sec': n_pairs / seconds}
+  return res
+
+
+def bench_skipgram(repeat, n_steps=200, batch_size=64, n_neg=15, n_dims=100):
+  """ Forward and backward passes of the model, with dense and sparse
+  gradients, for random batches. """
+  n_words = len(json.load(open(VOCAB_FILE)))
+  gen = torch.Generator().manual_seed(0)
+  batch = (
+    torch.randint(n_words, (batch_size,), generator=gen),
+    torch.randint(n_words, (batch_size,), generator=gen),
+    torch.randint(n_words, (batch_size, n_neg), generator=gen),
+  )
+  res = {}
+  for sparse in [False, True]:
+    model = Skipgram(n_words, n_dims, sparse=sparse)
+
+    def steps():
+      for _ in range(n_steps):
+        model.zero_grad()
+        (-model(*batch)).backward()
+
+    seconds, _ = best_time(steps, repeat)
+    res['sparse' if sparse else 'dense'] = {
+      'seconds': seconds, 'steps_per_sec': n_steps / seconds
+    }
+  return res
+
+
+def bench_apply_sum(repeat):
+  """ Sum the word vectors of all docs, with apply_sum() and with its
+  vectorized version. """
+  n_docs = len(json.load(open('data/bow/docs.json')))
+  res = {}
+  for name, func in [
+      ('json', lambda: apply_sum(
+        'data/bow/docs.json', 'data/vecs/embeddings.json',
+        'data/bench/docs_sum.json'
+      )),
+      ('matrix', lambda: apply_sum_matrix(
+        'data/bow/docs.json', 'data/vecs/embeddings.json',
+        'data/bench/docs_sum'
+      ))]:
+    seconds, _ = best_time(func, repeat)
+    res[name] = {'seconds': seconds, 'docs_per_sec': n_docs / seconds}
+  return res
+
+
+def bench_doc_retriever(repeat, n_lookups=2000):
+  """ Build the index of DocRetriever and look up random docs with get_vec()
+  and in batches with get_vecs(). """
+  index_file = 'data/vecs/doc_index.json'
+
+  def build():
+    if path.exists(index_file):
+      remove(index_file)
+    return DocRetriever()
+
+  build_seconds, docs = best_time(build, repeat)
+  rng = np.random.default_rng(0)
+  ids = rng.choice(list(docs.ids), n_lookups).tolist()
+  get_seconds, _ = best_time(lambda: [docs.get_vec(id) for id in ids], repeat)
+  batch_seconds, _ = best_time(lambda: docs.get_vecs(ids), repeat)
+  return {
+    'index': {'seconds': build_seconds},
+    'get_vec': {'lookups_per_sec': n_lookups / get_seconds},
+    'get_vecs': {'lookups_per_sec': n_lookups / batch_seconds},
+  }
+
+
+def bench_compute_distances(repeat, n_docs=200):
+  """ Distances between docs and all subjects with each distance function,
+  and with the per-pair reference of cos_avg for comparison. """
+  docs = DocRetriever().get_vecs(
+    list(json.load(open('data/bow/docs.json')))[:n_docs]
+  )
+  subjects = json.load(open('data/vecs/subjects.json'))
+  summed = {id: np.sum(vec, axis=0) for id, vec in subjects.items()}
+  docs_summed = {id: np.sum(vec, axis=0) for id, vec in docs.items() if vec}
+  n_pairs = len(docs) * len(subjects)
+  res = {}
+  for name, func, doc_vecs, subject_vecs in [
+      ('cos_sum', cos_sum, docs_summed, summed),
+      ('cos_avg', cos_avg, docs, subjects),
+      ('cos_concat', cos_concat, docs, subjects)]:
+    seconds, _ = best_time(
+      lambda: compute_distances(doc_vecs, subject_vecs, func, 50), repeat
+    )
+    res[name] = {'seconds': seconds, 'pairs_per_sec': n_pairs / seconds}
+  few = dict(list(docs.items())[:10])
+  seconds, _ = best_time(lambda: [
+    cos_avg(doc, subject) for doc in few.values()
+    for subject in subjects.values()
+  ], repeat)
+  res['cos_avg_reference'] = {
+    'seconds': seconds, 'pairs_per_sec': len(few) * len(subjects) / seconds
+  }
+  return res
+
+
+def bench_representer(repeat):
+  """ Load the Representer and compute the representations of all docs. """
+  init_seconds, representer = best_time(Representer, repeat)
+  seconds, _ = best_time(
+    lambda: representer.get_representations('data/bench/docs_ert.json'),
+    repeat
+  )
+  return {
+    'init': {'seconds': init_seconds},
+    'represent': {
+      'seconds': seconds, 'docs_per_sec': len(representer.data) / seconds
+    },
+  }
+
+
+def bench_create_ert(repeat):
+  """ Compute the ERT of every venue. """
+  data = json.load(open(DATA_FILE))
+  venues = json.load(open('data/json/dim/all/ert/venue_publications.json'))
+  seconds, _ = best_time(
+    lambda: [create_ert(ids, data) for ids in venues.values()], repeat
+  )
+  return {'seconds': seconds, 'venues_per_sec': len(venues) / seconds}
+
+
+BENCHMARKS = {
+  'dataset': bench_dataset,
+  'skipgram': bench_skipgram,
+  'apply_sum': bench_apply_sum,
+  'doc_retriever': bench_doc_retriever,
+  'compute_distances': bench_compute_distances,
+  'representer': bench_representer,
+  'create_ert': bench_create_ert,
+}
+
+
+def run(names=None, folder=None, dump_file=None, repeat=3, **config):
+  """ Run the given benchmarks, or all of them, on the synthetic dataset in
+  the folder, which is generated if needed, and dump the results.
+  folder (str): folder of the dataset; a temporary one if None.
+  dump_file (str): defaults to 'benchmarks/results/{commit}.json'.
+  config: overrides the configuration of the dataset (see synthetic.CONFIG).
+  """
+  commit = git_commit()
+  if dump_file is None:
+    makedirs('benchmarks/results', exist_ok=True)
+    dump_file = f'benchmarks/results/{commit[:10]}.json'
+  dump_file = path.abspath(dump_file)
+  if folder is None:
+    folder = tempfile.mkdtemp(prefix='benchmarks_')
+  config = generate(folder, **config)
+  res = {}
+  with working_dir(folder):
+    torch.manual_seed(0)
+    for name in names if names else BENCHMARKS:
+      res[name] = BENCHMARKS[name](repeat)
+  json.dump({
+    'commit': commit,
+    'date': strftime('%Y-%m-%d %H:%M:%S'),
+    'python': platform.python_version(),
+    'numpy': np.__version__,
+    'torch': torch.__version__,
+    'threads': torch.get_num_threads(),
+    'config': config,
+    'results': res,
+  }, open(dump_file, 'w'), indent=2)
+  return res
+
+
+def git_commit():
+  """ Return the hash of the current commit, or 'unknown'. """
+  try:
+    return subprocess.run(
+      ['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True
+    ).stdout.strip()
+  except (OSError, subprocess.CalledProcessError):
+    return 'unknown'
+
+
+def compare(old_file, new_file):
+  """ Return the ratio new / old of each metric present in both files. Ratios
+  above one are improvements for throughputs ('_per_sec') and regressions
+  for durations ('seconds'). """
+  old = flatten(json.load(open(old_file))['results'])
+  new = flatten(json.load(open(new_file))['results'])
+  return {key: new[key] / old[key] for key in new if old.get(key)}
+
+
+def flatten(results, prefix=''):
+  """ Flatten the nested dict of results into a dict with keys such as
+  'dataset.txt.pairs_per_sec'. """
+  flat = {}
+  for key, value in results.items():
+    if isinstance(value, dict):
+      flat.update(flatten(value, f'{prefix}{key}.'))
+    else:
+      flat[f'{prefix}{key}'] = value
+  return flat
+
+
+if __name__ == '__main__':
+  if len(sys.argv) > 1 and sys.argv[1] == '--compare':
+    print(json.dumps(compare(sys.argv[2], sys.argv[3]), indent=2))
+  else:
+    print(json.dumps(run(sys.argv[1:]), indent=2))
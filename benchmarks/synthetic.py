@@ -0,0 +1,154 @@
+""" Generate a synthetic dataset with the schemas of the files in 'data', so
+that the scripts can be benchmarked without the real data. Words are drawn
+from a Zipfian distribution, as real words are. The files are written under
+'{folder}/data', with the paths hard-coded in the scripts, and the scripts
+of the project are used wherever they derive one file from others:
+
+- data/json/dim/all/data_lemmas_vocab.json: docs with title and abstract.
+- data/vocab/vocab_counts.json and vocab_freqs.json: counts and frequencies.
+- data/txt/data_lemmas.txt and the encoded corpus with the same prefix.
+- data/bow/docs.json: BoW of the docs (create_bow.bow_data).
+- data/vecs/embeddings.json: random word embeddings.
+- data/vecs/docs_{n}.json: word vectors of the docs (apply_segmented).
+- data/json/dim/all/relevant_venues.json and ert/venue_publications.json.
+- data/json/dim/all/ert/advisors.json and referees.json: docs of each person.
+- data/json/dim/all/ert/{venue,advisor,referee}_lemmas_vocab.json: words.
+- data/openalex/subjects.json and field_subjects.json: subject hierarchy.
+- data/vecs/subjects.json: word vectors of the subjects. """
+
+
+from contextlib import contextmanager
+from os import chdir, getcwd, makedirs, path
+import json
+
+import numpy as np
+
+from apply_embeddings import apply_segmented
+from assign_subjects import sort_subjects
+from benchmarks.sampler import zipf_freqs
+from create_bow import bow_data
+from prepare_data import prepare_data, encode_corpus
+from skipgram.utils import compute_freqs
+from venue_ert import get_publications
+
+
+CONFIG = {
+  'n_docs': 2000,
+  'n_words': 5000,
+  'n_venues': 40,
+  'n_advisors': 30,
+  'n_referees': 30,
+  'n_fields': 10,
+  'n_subjects': 300,
+  'n_dims': 50,
+  'seed': 0,
+}
+
+
+@contextmanager
+def working_dir(folder):
+  """ Change the working directory inside the 'with' block. """
+  cwd = getcwd()
+  chdir(folder)
+  try:
+    yield
+  finally:
+    chdir(cwd)
+
+
+def generate(folder, **config):
+  """ Generate the dataset in the folder, unless it was already generated
+  with the same configuration. The keyword arguments override CONFIG. Return
+  the configuration. """
+  config = {**CONFIG, **config}
+  config_file = f'{folder}/data/synthetic.json'
+  if path.exists(config_file) and json.load(open(config_file)) == config:
+    return config
+  for sub in ['json/dim/all/ert', 'json/dim/all/bow', 'vocab', 'txt', 'bow',
+      'vecs', 'openalex', 'distances/sum', 'bench']:
+    makedirs(f'{folder}/data/{sub}', exist_ok=True)
+  with working_dir(folder):
+    write_files(config, np.random.default_rng(config['seed']))
+  json.dump(config, open(config_file, 'w'))
+  return config
+
+
+def write_files(config, rng):
+  """ Write the files listed in the module docstring to the working dir. """
+  words = ['.'] + [f'w{i}' for i in range(1, config['n_words'])]
+  probs = zipf_freqs(len(words), power=1)
+  ert = 'data/json/dim/all/ert'
+
+  def draw(n):
+    return [words[i] for i in rng.choice(len(words), n, p=probs)]
+
+  docs = {}
+  for i in range(config['n_docs']):
+    abstract = []
+    for _ in range(rng.integers(0, 8)):  # sentences, separated by dots
+      abstract += draw(rng.integers(5, 25)) + ['.']
+    title = draw(rng.integers(3, 12))
+    docs[f'doc/{i}'] = {'title': title, 'abstract': abstract}
+  json.dump(docs, open('data/json/dim/all/data_lemmas_vocab.json', 'w'))
+  counts = {}
+  for doc in docs.values():
+    for word in doc['title'] + doc['abstract']:
+      counts[word] = counts.get(word, 0) + 1
+  json.dump(counts, open('data/vocab/vocab_counts.json', 'w'))
+  compute_freqs('data/vocab/vocab_counts.json', 'data/vocab/vocab_freqs.json')
+  prepare_data(
+    'data/json/dim/all/data_lemmas_vocab.json', 'data/vocab/vocab_freqs.json',
+    'data/txt/data_lemmas.txt'
+  )
+  encode_corpus(
+    'data/txt/data_lemmas.txt', 'data/vocab/vocab_freqs.json',
+    'data/txt/data_lemmas'
+  )
+  bow_data('data/json/dim/all/data_lemmas_vocab.json', 'data/bow/docs.json')
+  vecs = rng.uniform(-1, 1, (len(counts), config['n_dims']))
+  json.dump(
+    {word: vecs[i].tolist() for i, word in enumerate(counts)},
+    open('data/vecs/embeddings.json', 'w')
+  )
+  apply_segmented(
+    'data/bow/docs.json', 'data/vecs/embeddings.json', 'data/vecs/docs', 500
+  )
+
+  doc_ids = list(docs)
+  venue_probs = zipf_freqs(config['n_venues'], power=1)
+  json.dump({
+    doc: f'venue/{rng.choice(config["n_venues"], p=venue_probs)}'
+    for doc in doc_ids
+  }, open('data/json/dim/all/relevant_venues.json', 'w'))
+  get_publications()
+  venues = json.load(open(f'{ert}/venue_publications.json'))
+  for name, n in [('advisor', config['n_advisors']),
+      ('referee', config['n_referees'])]:
+    people = {
+      f'{name}/{i}': rng.choice(doc_ids, rng.integers(1, 20)).tolist()
+      for i in range(n)
+    }
+    json.dump(people, open(f'{ert}/{name}s.json', 'w'))
+    json.dump(
+      {id: draw(rng.integers(20, 200)) for id in people},
+      open(f'{ert}/{name}_lemmas_vocab.json', 'w')
+    )
+  json.dump(
+    {id: draw(rng.integers(20, 200)) for id in venues},
+    open(f'{ert}/venue_lemmas_vocab.json', 'w')
+  )
+
+  fields = [f'field/{i}' for i in range(config['n_fields'])]
+  subjects = {field: {'level': 0, 'ancestors': []} for field in fields}
+  for i in range(config['n_subjects'] - len(fields)):
+    ancestors = rng.choice(fields, rng.integers(1, 3), replace=False)
+    subjects[f'subject/{i}'] = {
+      'level': int(rng.integers(1, 4)),
+      'ancestors': [{'id': id} for id in ancestors.tolist()],
+    }
+  json.dump(subjects, open('data/openalex/subjects.json', 'w'))
+  sort_subjects()
+  json.dump({  # rows of random words of the vocab
+    id: vecs[rng.integers(0, len(vecs), rng.integers(1, 5))].tolist()
+    for id in subjects
+  }, open('data/vecs/subjects.json', 'w'))
@@ -0,0 +1,106 @@
+""" Read and write dicts of documents one item at a time, so that files larger
+than the RAM can be processed. Two formats are supported: JSON files with one
+object, as dumped by json.dump(), and JSON-lines files ('.jsonl'), where each
+line is an object with a single key, e.g. '{"doc_id": {"title": [...]}}'.
+
+JSON files are parsed incrementally: chunks of the file are read into a buffer
+and each key and value is decoded with json.JSONDecoder.raw_decode() as soon
+as it is complete, so that only one value is held in memory at a time. """
+
+
+import json
+
+
+DECODER = json.JSONDecoder()
+WHITESPACE = ' \t\n\r'
+
+
+def iter_items(data_file, chunk_size=2**20):
+  """ Yield the (key, value) pairs of the dict stored in the file, in the
+  order of the file. chunk_size (int) is the no. of characters read at once.
+  """
+  if data_file.endswith('.jsonl'):
+    with open(data_file, encoding='utf-8') as f:
+      for line in f:
+        if len(line.strip()) > 0:
+          yield from json.loads(line).items()
+    return
+  with open(data_file, encoding='utf-8') as f:
+    reader = Reader(f, chunk_size)
+    reader.expect('{')
+    if reader.peek() == '}':
+      return
+    while True:
+      key = reader.decode()
+      reader.expect(':')
+      yield key, reader.decode()
+      if reader.expect(',}') == '}':
+        return
+
+
+class Reader:
+  def __init__(self, file, chunk_size):
+    """ Buffer over a text file, from which JSON values are decoded. """
+    self.file = file
+    self.chunk_size = chunk_size
+    self.buffer, self.pos, self.eof = '', 0, False
+
+  def fill(self):
+    """ Append the next chunk of the file to the buffer, dropping the part
+    that has already been decoded. Return False at the end of the file. """
+    chunk = self.file.read(self.chunk_size)
+    self.buffer = self.buffer[self.pos:] + chunk
+    self.pos = 0
+    self.eof = len(chunk) == 0
+    return not self.eof
+
+  def peek(self):
+    """ Skip whitespace and return the next character without consuming it.
+    """
+    while True:
+      while self.pos < len(self.buffer) and self.buffer[self.pos] in WHITESPACE:
+        self.pos += 1
+      if self.pos < len(self.buffer):
+        return self.buffer[self.pos]
+      if not self.fill():
+        raise ValueError('Unexpected end of the JSON file')
+
+  def expect(self, chars):
+    """ Consume the next character, which must be one of 'chars', and return
+    it. """
+    char = self.peek()
+    if char not in chars:
+      raise ValueError(f'Expected one of "{chars}", found "{char}"')
+    self.pos += 1
+    return char
+
+  def decode(self):
+    """ Decode the next JSON value. A value that ends with the buffer may be
+    incomplete (e.g. a number), so that more of the file is read first. """
+    self.peek()
+    while True:
+      try:
+        value, end = DECODER.raw_decode(self.buffer, self.pos)
+        if end < len(self.buffer) or self.eof:
+          self.pos = end
+          return value
+      except json.JSONDecodeError:
+        if self.eof:
+          raise
+      self.fill()
+
+
+def dump_items(items, dump_file):
+  """ Write the (key, value) pairs as they are yielded. The file is a JSON
+  file with the same content as json.dump() would write for the dict, unless
+  its name ends with '.jsonl'. """
+  with open(dump_file, 'w', encoding='utf-8') as f:
+    if dump_file.endswith('.jsonl'):
+      for key, value in items:
+        f.write(json.dumps({key: value}) + '\n')
+      return
+    f.write('{')
+    for i, (key, value) in enumerate(items):
+      f.write((', ' if i > 0 else '') + json.dumps(key) + ': ')
+      f.write(json.dumps(value))
+    f.write('}')
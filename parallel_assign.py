@@ -0,0 +1,181 @@
+""" Assign fields and subjects to the documents with several processes. The
+documents are split into shards, which are processed by a ProcessPoolExecutor;
+each worker computes the distances of its shard to the fields and then to the
+descendants of the closest fields, as find_fields() and find_subjects() of
+assign_subjects.py do, and dumps them to its own output file. Shards whose
+output file exists are skipped, so that an interrupted run can be resumed.
+When all shards are done, their outputs are merged into 'l0_distances.json'
+and 'top_50_subjects.json'.
+
+The subject vectors are dumped once to a .npy file in the work folder, which
+the workers memory-map read-only, so that the OS shares its pages between them.
+They are dumped as the distance function uses them: normalized for cos_sum
+and cos_avg, and with the cumulative norms of assign_subjects.prepare_subjects()
+in a second file for sequences, so that the workers never copy them.
+The summed doc vectors (cos_sum) are memory-mapped in the same way; the
+sequences of word vectors are retrieved by each worker with DocRetriever. """
+
+
+from concurrent.futures import ProcessPoolExecutor
+from os import makedirs, path, replace
+import json
+
+import numpy as np
+
+from retrieve_docs import DocRetriever
+from apply_embeddings import load_doc_vecs
+import assign_subjects as assign
+
+
+FUNCS = {
+  'cos_sum': assign.cos_sum,
+  'cos_avg': assign.cos_avg,
+  'cos_concat': assign.cos_concat,
+}
+
+
+def assign_parallel(folder, func, n_shards=16, n_workers=None, n_fields=3,
+    n=50, chunk_size=256):
+  """ Assign fields and subjects to all docs and dump the results to
+  'data/distances/{folder}'. The intermediate files are stored in its
+  subfolder 'shards', which can be removed once the results are merged.
+  func (str): name of the distance function (see FUNCS).
+  n_shards (int): no. of shards in which the docs are split. It is only used
+    in the first run; later runs keep the shards of the first one.
+  n_workers (int): no. of processes; defaults to the no. of CPUs.
+  n_fields, n (int): arguments of assign_subjects.find_subjects().
+  chunk_size (int): no. of docs whose distances are computed at once. """
+  work_dir = f'data/distances/{folder}/shards'
+  makedirs(work_dir, exist_ok=True)
+  shards = plan_shards(work_dir, func, n_shards)
+  pending = [
+    nr for nr in range(len(shards))
+    if not path.exists(f'{work_dir}/{nr}.json')
+  ]
+  with ProcessPoolExecutor(n_workers) as executor:
+    futures = [
+      executor.submit(
+        assign_shard, work_dir, nr, func, n_fields, n, chunk_size
+      ) for nr in pending
+    ]
+    for future in futures:
+      future.result()  # raise the exceptions of the workers
+  merge_shards(work_dir, len(shards), f'data/distances/{folder}')
+
+
+def plan_shards(work_dir, func, n_shards):
+  """ Split the docs into shards and dump the shared inputs of the workers,
+  unless a previous run already did so. The shards are lists of doc IDs for
+  sequences and lists of rows of the doc matrix for cos_sum. """
+  shards_file = f'{work_dir}/shards.json'
+  if path.exists(shards_file):
+    return json.load(open(shards_file))
+  subjects = json.load(open('data/vecs/subjects.json'))
+  with open(f'{work_dir}/subjects.ids.txt', 'w', encoding='utf-8') as f:
+    for id in subjects:
+      f.write(id + '\n')
+  if func == 'cos_sum':
+    matrix = assign.load_subjects_sum()[1]
+    np.save(f'{work_dir}/subjects.npy', assign.normalize(matrix))
+    doc_prefix = docs_sum_prefix(work_dir)
+    with open(f'{doc_prefix}.ids.txt', encoding='utf-8') as f:
+      docs = list(range(len(f.read().split('\n')[:-1])))
+  else:
+    padded, lens = assign.pad(list(subjects.values()))
+    padded, norms = assign.prepare_subjects(padded, FUNCS[func])
+    np.save(f'{work_dir}/subjects.npy', padded)
+    np.save(f'{work_dir}/subjects.lens.npy', lens)
+    np.save(f'{work_dir}/subjects.norms.npy', norms)
+    docs = list(DocRetriever().ids)
+  size = -(-len(docs) // n_shards)
+  shards = [docs[i:i+size] for i in range(0, len(docs), size)]
+  json.dump(shards, open(f'{shards_file}.tmp', 'w'))
+  replace(f'{shards_file}.tmp', shards_file)
+  return shards
+
+
+def docs_sum_prefix(work_dir):
+  """ Return the prefix of the matrix of summed doc vectors. If only the JSON
+  file of apply_embeddings.apply_sum() exists, it is converted to a matrix in
+  the work folder. """
+  if path.exists('data/vecs/docs_sum.npy'):
+    return 'data/vecs/docs_sum'
+  prefix = f'{work_dir}/docs_sum'
+  if not path.exists(f'{prefix}.npy'):
+    ids, matrix = assign.load_docs_sum()
+    with open(f'{prefix}.ids.txt', 'w', encoding='utf-8') as f:
+      for id in ids:
+        f.write(id + '\n')
+    np.save(f'{prefix}.npy', matrix.astype(np.float32))
+  return prefix
+
+
+def assign_shard(work_dir, nr, func, n_fields, n, chunk_size):
+  """ Compute the fields and subjects of the docs of the nr-th shard and dump
+  them to '{work_dir}/{nr}.json'. The file is written under a temporary name
+  and renamed when it is complete. Docs without vectors are left out. """
+  with open(f'{work_dir}/subjects.ids.txt', encoding='utf-8') as f:
+    subject_ids = f.read().split('\n')[:-1]
+  subjects = np.load(f'{work_dir}/subjects.npy', mmap_mode='r')
+  lens, norms = None, None
+  if func != 'cos_sum':
+    lens = np.load(f'{work_dir}/subjects.lens.npy')
+    norms = np.load(f'{work_dir}/subjects.norms.npy', mmap_mode='r')
+  shard = json.load(open(f'{work_dir}/shards.json'))[nr]
+  if func == 'cos_sum':
+    ids, matrix = load_doc_vecs(docs_sum_prefix(work_dir))
+    doc_ids, docs = [ids[i] for i in shard], assign.normalize(matrix[shard])
+  else:
+    vecs = DocRetriever().get_vecs(shard)
+    doc_ids, docs = list(vecs.keys()), list(vecs.values())
+  subject_info = json.load(open('data/openalex/subjects.json'))
+  l0_rows = np.array([
+    i for i, id in enumerate(subject_ids) if subject_info[id]['level'] == 0
+  ], dtype=np.int64)
+  l0_ids = [subject_ids[i] for i in l0_rows]
+  l0_lens = lens[l0_rows] if lens is not None else None
+  l0_norms = norms[l0_rows] if norms is not None else None
+  blocks = shard_topk(
+    docs, subjects[l0_rows], l0_lens, l0_norms, func, None, chunk_size
+  )
+  fields = dict(assign.topk_items(doc_ids, l0_ids, blocks))
+  masks = assign.field_masks(
+    doc_ids, fields, assign.get_field_rows(subject_ids), len(subject_ids),
+    n_fields
+  )
+  blocks = shard_topk(
+    docs, subjects, lens, norms, func, n, chunk_size, masks
+  )
+  res = {
+    'l0': fields,
+    'subjects': dict(assign.topk_items(doc_ids, subject_ids, blocks)),
+  }
+  json.dump(res, open(f'{work_dir}/{nr}.json.tmp', 'w'))
+  replace(f'{work_dir}/{nr}.json.tmp', f'{work_dir}/{nr}.json')
+
+
+def shard_topk(docs, subjects, lens, norms, func, n, chunk_size,
+    masks=None):
+  """ Return the blocks of the closest subjects of cosine_topk() for cos_sum
+  and of seq_topk() otherwise, with the prepared subjects and norms. """
+  if func == 'cos_sum':
+    return assign.cosine_topk(docs, subjects, n, chunk_size, masks)
+  return assign.seq_topk(
+    docs, subjects, lens, FUNCS[func], n, chunk_size, masks, norms
+  )
+
+
+def merge_shards(work_dir, n_shards, dump_folder):
+  """ Merge the outputs of the shards into the files of find_fields() and
+  find_subjects(). """
+  fields, subjects = {}, {}
+  for nr in range(n_shards):
+    res = json.load(open(f'{work_dir}/{nr}.json'))
+    fields.update(res['l0'])
+    subjects.update(res['subjects'])
+  json.dump(fields, open(f'{dump_folder}/l0_distances.json', 'w'))
+  json.dump(subjects, open(f'{dump_folder}/top_50_subjects.json', 'w'))
+
+
+if __name__ == '__main__':
+  assign_parallel('sum', 'cos_sum', n_fields=5, n=20)
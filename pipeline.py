@@ -0,0 +1,265 @@
+""" Run the preprocessing scripts as a pipeline. Each stage is a function of
+one of the scripts, called with the hard-coded paths of its '__main__' block,
+and declares the files it reads and writes. A stage depends on the stages that
+write its inputs, and stages whose dependencies are done run concurrently, each
+in its own process.
+
+The SHA-256 hashes of the files are stored in a state file, along with a key
+for each stage, which is the hash of its function, its arguments and the hashes
+of its inputs. A stage is skipped if its key hasn't changed and its outputs
+still have the hashes that it recorded. Files are only hashed again when their
+size or modification time change. The wall time and the peak memory of each
+stage that runs are logged and stored in the state file.
+
+Run 'python pipeline.py' to bring all outputs up to date, or pass the names of
+stages to run only them and the stages they depend on. """
+
+
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from importlib import import_module
+from os import makedirs, path, remove, replace
+from time import perf_counter
+import hashlib
+import json
+import logging
+import resource
+import sys
+
+
+STATE_FILE = 'data/pipeline_state.json'
+DATA = 'data/json/dim/all/data_lemmas_vocab.json'
+ERT = 'data/json/dim/all/ert'
+
+
+def represent_docs(dump_file):
+  """ Compute the representations of the docs (see represent_docs.py). """
+  from represent_docs import Representer
+  Representer().get_representations(dump_file)
+
+
+STAGES = {
+  'publications': {
+    'func': 'venue_ert.get_publications',
+    'args': [],
+    'inputs': ['data/json/dim/all/relevant_venues.json'],
+    'outputs': [f'{ERT}/venue_publications.json'],
+  },
+  'venue_ert': {
+    'func': 'venue_ert.get_erts',
+    'args': [f'{ERT}/venue_publications.json', f'{ERT}/venue_ert.json'],
+    'inputs': [f'{ERT}/venue_publications.json', DATA],
+    'outputs': [f'{ERT}/venue_ert.json'],
+  },
+  'bow_venues': {
+    'func': 'venue_ert.get_bow',
+    'args': [f'{ERT}/venue_ert.json', 'data/bow/venues.json'],
+    'inputs': [f'{ERT}/venue_ert.json'],
+    'outputs': ['data/bow/venues.json'],
+  },
+  'bow_referees': {
+    'func': 'create_bow.bow_venues',
+    'args': [
+      f'{ERT}/referee_lemmas_vocab.json', 'data/json/dim/all/bow/referees.json'
+    ],
+    'inputs': [f'{ERT}/referee_lemmas_vocab.json'],
+    'outputs': ['data/json/dim/all/bow/referees.json'],
+  },
+  'bow_docs': {
+    'func': 'create_bow.bow_data',
+    'args': [DATA, 'data/bow/docs.json'],
+    'inputs': [DATA],
+    'outputs': ['data/bow/docs.json'],
+  },
+  'prepare_data': {
+    'func': 'prepare_data.prepare_data',
+    'args': [DATA, 'data/vocab/repo_vocab_step_4.json',
+      'data/txt/data_lemmas.txt'],
+    'inputs': [DATA, 'data/vocab/repo_vocab_step_4.json'],
+    'outputs': ['data/txt/data_lemmas.txt'],
+  },
+  'represent_docs': {
+    'func': 'pipeline.represent_docs',
+    'args': [f'{ERT}/docs.json'],
+    'inputs': [
+      f'{ERT}/venue_lemmas_vocab.json', f'{ERT}/advisor_lemmas_vocab.json',
+      f'{ERT}/referee_lemmas_vocab.json', f'{ERT}/venue_publications.json',
+      f'{ERT}/advisors.json', f'{ERT}/referees.json', DATA,
+    ],
+    'outputs': [f'{ERT}/docs.json'],
+  },
+  'apply_sum': {  # load_docs_sum() reads the matrix when it exists
+    'func': 'apply_embeddings.apply_sum_matrix',
+    'args': ['data/bow/docs.json', 'data/vecs/embeddings.json',
+      'data/vecs/docs_sum'],
+    'inputs': ['data/bow/docs.json', 'data/vecs/embeddings.json'],
+    'outputs': ['data/vecs/docs_sum.npy', 'data/vecs/docs_sum.ids.txt'],
+  },
+  'sort_subjects': {
+    'func': 'assign_subjects.sort_subjects',
+    'args': [],
+    'inputs': ['data/openalex/subjects.json'],
+    'outputs': ['data/openalex/field_subjects.json'],
+  },
+  'fields_sum': {
+    'func': 'assign_subjects.find_fields_sum',
+    'args': ['data/distances/sum/l0_distances.json'],
+    'inputs': ['data/vecs/docs_sum.npy', 'data/vecs/docs_sum.ids.txt',
+      'data/vecs/subjects.json', 'data/openalex/subjects.json'],
+    'outputs': ['data/distances/sum/l0_distances.json'],
+  },
+  'subjects_sum': {
+    'func': 'assign_subjects.find_subjects_sum',
+    'args': [],
+    'inputs': ['data/vecs/docs_sum.npy', 'data/vecs/docs_sum.ids.txt',
+      'data/vecs/subjects.json', 'data/openalex/field_subjects.json',
+      'data/distances/sum/l0_distances.json'],
+    'outputs': ['data/distances/sum/top_50_subjects.json'],
+    'clean': ['data/distances/sum/top_50_subjects.jsonl'],  # resume file
+  },
+}
+
+
+def run(targets=None, n_procs=2, stages=STAGES, state_file=STATE_FILE):
+  """ Run the given stages and the stages they depend on, or all stages if
+  targets is None. Stages that are up to date are skipped.
+  n_procs (int): max. no. of stages that run at once. """
+  producers = {
+    out: name for name, st in stages.items() for out in st['outputs']
+  }
+  deps = {
+    name: {producers[f] for f in st['inputs'] if f in producers}
+    for name, st in stages.items()
+  }
+  todo = select_stages(targets if targets is not None else stages, deps)
+  state = load_state(state_file)
+  done, running = set(), {}
+  try:
+    while len(todo) > 0 or len(running) > 0:
+      ready = [name for name in todo if deps[name] <= done]
+      for name in ready:
+        stage = stages[name]
+        key = stage_key(stage, state)
+        if is_current(name, stage, key, state):
+          logging.info(f'{name}: up to date')
+          todo.remove(name)
+          done.add(name)
+          continue
+        if len(running) >= n_procs:
+          continue
+        todo.remove(name)
+        for file in stage.get('clean', []):
+          if path.exists(file):
+            remove(file)
+        for file in stage['outputs']:
+          makedirs(path.dirname(file), exist_ok=True)
+        executor = ProcessPoolExecutor(1)  # a new process for each stage
+        future = executor.submit(run_stage, stage['func'], stage['args'])
+        running[future] = (name, key, executor)
+      if len(running) == 0:
+        if len(ready) == 0:
+          raise ValueError(f'Stages with cyclic dependencies: {todo}')
+        continue  # skipped stages may have released others
+      finished, _ = wait(running, return_when=FIRST_COMPLETED)
+      for future in finished:
+        name, key, executor = running.pop(future)
+        executor.shutdown()
+        report = future.result()
+        state['stages'][name] = {
+          'key': key,
+          'outputs': {f: file_hash(f, state) for f in stages[name]['outputs']},
+          **report,
+        }
+        dump_state(state, state_file)
+        logging.info(
+          f'{name}: {report["seconds"]:.1f} s, '
+          f'peak memory {report["peak_rss_mb"]:.0f} MB'
+        )
+        done.add(name)
+  finally:
+    for _, _, executor in running.values():
+      executor.shutdown()
+
+
+def select_stages(targets, deps):
+  """ Return the set of stages formed by the targets and all the stages they
+  depend on, directly or indirectly. """
+  selected, stack = set(), list(targets)
+  while len(stack) > 0:
+    name = stack.pop()
+    if name not in selected:
+      selected.add(name)
+      stack += deps[name]
+  return selected
+
+
+def stage_key(stage, state):
+  """ Return the hash of the stage's function, arguments and inputs. """
+  content = json.dumps({
+    'func': stage['func'],
+    'args': stage['args'],
+    'inputs': {f: file_hash(f, state) for f in stage['inputs']},
+  }, sort_keys=True)
+  return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+
+def is_current(name, stage, key, state):
+  """ Return True if the stage ran with the same key and its outputs haven't
+  changed since. """
+  record = state['stages'].get(name)
+  if record is None or record['key'] != key:
+    return False
+  return all(
+    path.exists(f) and file_hash(f, state) == record['outputs'].get(f)
+    for f in stage['outputs']
+  )
+
+
+def file_hash(file, state):
+  """ Return the SHA-256 hash of the file. The hash is stored in the state
+  with the file's size and modification time, and only computed again when
+  they change. """
+  stat = [path.getsize(file), path.getmtime(file)]
+  cached = state['files'].get(file)
+  if cached is not None and cached[:2] == stat:
+    return cached[2]
+  sha = hashlib.sha256()
+  with open(file, 'rb') as f:
+    for block in iter(lambda: f.read(2**20), b''):
+      sha.update(block)
+  state['files'][file] = stat + [sha.hexdigest()]
+  return sha.hexdigest()
+
+
+def run_stage(func, args):
+  """ Import the stage's function and call it. Each stage runs in a new
+  process, so that the peak memory of the process is that of the stage. The
+  peak of its own child processes, if any, is reported separately. """
+  module, name = func.rsplit('.', 1)
+  start = perf_counter()
+  getattr(import_module(module), name)(*args)
+  return {
+    'seconds': perf_counter() - start,
+    'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    'children_peak_rss_mb':
+      resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024,
+  }
+
+
+def load_state(state_file):
+  """ Load the state file, or return an empty state. """
+  if path.exists(state_file):
+    return json.load(open(state_file))
+  return {'files': {}, 'stages': {}}
+
+
+def dump_state(state, state_file):
+  """ Dump the state under a temporary name and rename it, so that an
+  interruption doesn't leave a broken state file. """
+  makedirs(path.dirname(state_file), exist_ok=True)
+  json.dump(state, open(f'{state_file}.tmp', 'w'), indent=2)
+  replace(f'{state_file}.tmp', state_file)
+
+
+if __name__ == '__main__':
+  logging.basicConfig(level=logging.INFO, format='%(asctime)s %(message)s')
+  run(sys.argv[1:] or None)
@@ -1,9 +1,21 @@
-""" Functions to prepare the data for the skipgram training procedure. """
+""" Functions to prepare the data for the skipgram training procedure. The
+data files are read and the results written one document at a time (see
+json_stream.py), so that the memory usage doesn't grow with the corpus. Data
+files may also be JSON-lines files, with one '{id: doc}' object per line. """
 
 
+from concurrent.futures import ProcessPoolExecutor
 import json
+import os
 
+import numpy as np
+
+from json_stream import iter_items, dump_items
 from skipgram.utils import compute_freqs
+from skipgram.vocab import Vocab
+
+
+worker_vocab = None  # vocab of the workers of prepare_shards()
 
 
 def prepare_data(data_file, vocab_file, dump_file):
@@ -12,11 +24,10 @@ def prepare_data(data_file, vocab_file, dump_file):
   sentence per line. The data file is a dictionary with document IDs mapping to
   their corresponding titles and abstracts (id: {'title':txt, 'abstract':txt}).
   The vocab file is also a dictionary, with the words as keys and their counts
-  as values. """
-  data = json.load(open(data_file, encoding='utf-8'))
-  vocab = json.load(open(vocab_file, encoding='utf-8'))
+  as values, or the prefix of a compiled vocab (see skipgram.vocab). """
+  vocab = Vocab(vocab_file)
   txt_file = open(dump_file, 'w', encoding='utf-8')
-  for doc in data.values():
+  for _, doc in iter_items(data_file):
     for key in ['title', 'abstract']:
       if doc[key] is not None:
         text = (' ').join([l for l in doc[key] if l in vocab])
@@ -25,35 +36,132 @@ def prepare_data(data_file, vocab_file, dump_file):
             txt_file.write(sentence + '\n')
 
 
+def encode_corpus(txt_file, vocab_file, dump_prefix):
+  """ Encode the sentences of the TXT file created by prepare_data() as vocab
+  indices, so that the skipgram Dataset can iterate over them without parsing
+  the text in every epoch. The tokens are written to an int32 array and the
+  positions where the sentences start to an int64 array (see skipgram.corpus).
+  The file is read twice: first to count the tokens and then to fill the
+  memory-mapped arrays, so that the corpus is never held in RAM. The vocab
+  file must be the one used for training, as it determines the indices. """
+  vocab = Vocab(vocab_file)
+  n_tokens, n_sentences = 0, 0
+  for line in open(txt_file, encoding='utf-8'):
+    n_tokens += line.count(' ') + 1
+    n_sentences += 1
+  tokens = np.lib.format.open_memmap(
+    f'{dump_prefix}.tokens.npy', mode='w+', dtype=np.int32, shape=(n_tokens,)
+  )
+  offsets = np.lib.format.open_memmap(
+    f'{dump_prefix}.offsets.npy', mode='w+', dtype=np.int64,
+    shape=(n_sentences+1,)
+  )
+  pos = 0
+  for i, line in enumerate(open(txt_file, encoding='utf-8')):
+    ids = [vocab.get_idx(w) for w in line.replace('\n', '').split(' ')]
+    offsets[i] = pos
+    tokens[pos:pos+len(ids)] = ids
+    pos += len(ids)
+  offsets[n_sentences] = pos
+  tokens.flush()
+  offsets.flush()
+
+
+def prepare_shards(data_file, vocab_file, dump_prefix, n_procs=None,
+    shard_size=100000):
+  """ Prepare and encode the corpus with several processes, as prepare_data()
+  and encode_corpus() do together. The docs are read in chunks of
+  'shard_size' docs, and each chunk is filtered, split into sentences and
+  encoded by a worker, which dumps it as a corpus with the prefix
+  '{dump_prefix}_{nr}' (see skipgram.corpus). The prefixes of the shards are
+  listed in order in '{dump_prefix}.shards.json', which is the data file of
+  the skipgram Dataset; their sentences are in the same order as in the file
+  of prepare_data(). At most two chunks per process are held in memory.
+  n_procs (int): no. of processes; defaults to the no. of CPUs. """
+  n_procs = n_procs if n_procs is not None else os.cpu_count()
+  shards, pending = [], []
+  chunks = iter_chunks(iter_items(data_file), shard_size)
+  with ProcessPoolExecutor(
+    n_procs, initializer=init_worker, initargs=(vocab_file,)
+  ) as executor:
+    for nr, chunk in enumerate(chunks, 1):
+      prefix = f'{dump_prefix}_{nr}'
+      pending.append(executor.submit(encode_shard, chunk, prefix))
+      shards.append(prefix)
+      if len(pending) >= 2 * n_procs:
+        pending.pop(0).result()
+    for future in pending:
+      future.result()  # raise the exceptions of the workers
+  json.dump(shards, open(f'{dump_prefix}.shards.json', 'w'))
+
+
+def iter_chunks(items, size):
+  """ Yield lists with the values of 'size' consecutive items. """
+  chunk = []
+  for _, value in items:
+    chunk.append(value)
+    if len(chunk) == size:
+      yield chunk
+      chunk = []
+  if len(chunk) > 0:
+    yield chunk
+
+
+def init_worker(vocab_file):
+  """ Load the vocab in a worker of prepare_shards(). """
+  global worker_vocab
+  worker_vocab = Vocab(vocab_file)
+
+
+def encode_shard(docs, dump_prefix):
+  """ Filter the docs with the vocab of the worker, split them into sentences
+  as prepare_data() does and dump their vocab indices (see encode_corpus()).
+  """
+  tokens, offsets = [], [0]
+  for doc in docs:
+    for key in ['title', 'abstract']:
+      if doc[key] is not None:
+        text = (' ').join([l for l in doc[key] if l in worker_vocab])
+        for sentence in text.split(' . '):
+          if len(sentence) > 0:
+            tokens += [worker_vocab.get_idx(w) for w in sentence.split(' ')]
+            offsets.append(len(tokens))
+  np.save(f'{dump_prefix}.tokens.npy', np.array(tokens, dtype=np.int32))
+  np.save(f'{dump_prefix}.offsets.npy', np.array(offsets, dtype=np.int64))
+
+
 def prepare_json_data(data_file, vocab_file, dump_file):
   """ Given data and a vocabulary, remove all words from the data that are not
   in the vocabulary and place the resulting sentences in a JSON file. The data
   file is a dictionary with document IDs mapping to their corresponding titles
   and abstracts (id: {'title':txt, 'abstract':txt}). The vocab file is also a
-  dictionary, with the words as keys and their counts as values. """
-  data = json.load(open(data_file, encoding='utf-8'))
-  vocab = json.load(open(vocab_file, encoding='utf-8'))
-  res = {}
-  for doc_id in data:
-    res[doc_id] = {}
-    for key in ['title', 'abstract']:
-      if data[doc_id][key] is not None:
-        res[doc_id][key] = [w for w in data[doc_id][key] if w in vocab]
-      else:
-        res[doc_id][key] = []
-  json.dump(res, open(dump_file, 'w', encoding='utf-8'))
+  dictionary, with the words as keys and their counts as values, or the prefix
+  of a compiled vocab. If the dump file ends with '.jsonl', it is written as a
+  JSON-lines file. """
+  vocab = Vocab(vocab_file)
+
+  def filter_docs():
+    for doc_id, doc in iter_items(data_file):
+      res = {}
+      for key in ['title', 'abstract']:
+        if doc[key] is not None:
+          res[key] = [w for w in doc[key] if w in vocab]
+        else:
+          res[key] = []
+      yield doc_id, res
+
+  dump_items(filter_docs(), dump_file)
 
 
 def prepare_json_data_for_subjects(subjects_file, vocab_file, dump_file):
   """ Retrieve the prepared texts for the IDs present in the IDs file,
   concatenate them and dump them. The vocab file is also a dict, with
-  word-count pairs. """
-  subjects = json.load(open(subjects_file, encoding='utf-8'))
-  vocab = json.load(open(vocab_file, encoding='utf-8'))
-  res = {}
-  for subject_id in subjects:
-    res[subject_id] = [w for w in subjects[subject_id] if w in vocab]
-  json.dump(res, open(dump_file, 'w', encoding='utf-8'))
+  word-count pairs, or the prefix of a compiled vocab. """
+  vocab = Vocab(vocab_file)
+  dump_items((
+    (subject_id, [w for w in words if w in vocab])
+    for subject_id, words in iter_items(subjects_file)
+  ), dump_file)
 
 
 if __name__ == '__main__':
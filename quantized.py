@@ -0,0 +1,119 @@
+""" Matrices of vectors stored with reduced precision, which take less memory
+and less time to read than float32 matrices. Two formats are supported:
+
+- 'float16': the values are cast to float16, which halves the size.
+- 'int8': each row is divided by a scale, such that its largest absolute value
+  becomes 127, and rounded to int8. The scales are stored as float32, so that
+  the size is roughly a quarter. Scaling each row on its own keeps the relative
+  error of all rows small, regardless of their norms.
+
+A matrix with the prefix 'prefix' is stored in '{prefix}.npy' and, for int8,
+'{prefix}.scales.npy'. The values are memory-mapped when loaded, and rows are
+only converted back to float32 when they are read, one block at a time. Only
+the memory and the disk space are reduced: numpy has no fast float16 or int8
+matrix products, so that computations on the rows are done in float32. """
+
+
+from os import path, replace
+
+import numpy as np
+
+
+DTYPES = ('float16', 'int8')
+
+
+class QuantizedMatrix:
+  def __init__(self, values, scales=None):
+    """ values (array): quantized values, float16 or int8. float32 values
+      are accepted as well and returned as they are.
+    scales (array): scale of each row for int8 values, or None. """
+    self.values = values
+    self.scales = scales
+    self.dtype = str(values.dtype)
+    self.shape = values.shape
+
+  def __len__(self):
+    """ Return the no. of rows. """
+    return len(self.values)
+
+  def __getitem__(self, idx):
+    """ Return the given rows as a float32 array. """
+    rows = np.asarray(self.values[idx], dtype=np.float32)
+    if self.scales is not None:
+      rows *= np.asarray(self.scales[idx])[..., None]
+    return rows
+
+  @property
+  def nbytes(self):
+    """ Return the size of the stored values and scales in bytes. """
+    size = self.values.nbytes
+    return size + (self.scales.nbytes if self.scales is not None else 0)
+
+  def take(self, rows):
+    """ Return a new quantized matrix with the given rows. """
+    scales = self.scales[rows] if self.scales is not None else None
+    return QuantizedMatrix(self.values[rows], scales)
+
+  def save(self, prefix):
+    """ Store the matrix with the given prefix (see the module docstring). """
+    np.save(f'{prefix}.npy', self.values)
+    if self.scales is not None:
+      np.save(f'{prefix}.scales.npy', self.scales)
+
+
+def quantize(matrix, dtype):
+  """ Return the quantized matrix of the given float matrix. The scales of
+  int8 values are computed over the last axis, so that a 3D array of padded
+  sequences gets a scale per word vector. """
+  if dtype not in DTYPES:
+    raise ValueError(f'Unknown dtype {dtype}; use one of {DTYPES}')
+  matrix = np.asarray(matrix, dtype=np.float32)
+  if dtype == 'float16':
+    return QuantizedMatrix(matrix.astype(np.float16))
+  scales = np.abs(matrix).max(axis=-1) / 127
+  scales[scales == 0] = 1  # zero rows stay zero
+  values = np.rint(matrix / scales[..., None]).astype(np.int8)
+  return QuantizedMatrix(values, scales.astype(np.float32))
+
+
+def load_quantized(prefix, mmap=True):
+  """ Load the quantized matrix stored with the given prefix. """
+  mode = 'r' if mmap else None
+  values = np.load(f'{prefix}.npy', mmap_mode=mode)
+  scales = None
+  if path.exists(f'{prefix}.scales.npy'):
+    scales = np.load(f'{prefix}.scales.npy', mmap_mode=mode)
+  return QuantizedMatrix(values, scales)
+
+
+def quantize_rows(matrix, dtype, dump_prefix, transform=None,
+    chunk_size=10000):
+  """ Quantize the rows of a large (e.g. memory-mapped) matrix in chunks and
+  write them to memory-mapped files, so that neither the matrix nor the
+  result is held in RAM. transform is an optional function applied to each
+  chunk before quantizing it, e.g. normalization. The files are written
+  under temporary names and renamed when they are complete, so that an
+  interruption doesn't leave a partly filled matrix. """
+  values = np.lib.format.open_memmap(
+    f'{dump_prefix}.npy.tmp', mode='w+', dtype=dtype, shape=matrix.shape
+  )
+  scales = None
+  if dtype == 'int8':
+    scales = np.lib.format.open_memmap(
+      f'{dump_prefix}.scales.npy.tmp', mode='w+', dtype=np.float32,
+      shape=matrix.shape[:-1]
+    )
+  for start in range(0, len(matrix), chunk_size):
+    chunk = np.asarray(matrix[start:start+chunk_size], dtype=np.float32)
+    if transform is not None:
+      chunk = transform(chunk)
+    quantized = quantize(chunk, dtype)
+    values[start:start+len(chunk)] = quantized.values
+    if scales is not None:
+      scales[start:start+len(chunk)] = quantized.scales
+  values.flush()
+  replace(f'{dump_prefix}.npy.tmp', f'{dump_prefix}.npy')
+  if scales is not None:
+    scales.flush()
+    replace(f'{dump_prefix}.scales.npy.tmp', f'{dump_prefix}.scales.npy')
+  return load_quantized(dump_prefix)
@@ -3,11 +3,22 @@ of the BoW representations of the docs (title + abstract) and a weighted
 BoW representation of the venues. To avoid duplicates in the BoW representation
 we count the frequencies of all words that will be used for a given doc, and
 then sort them by frequency. This is not a proper BoW, as non-present words
-are ignored, but it serves our purpose. """
+are ignored, but it serves our purpose.
+
+The venues, advisors and referees of each doc are found with an inverted index
+that maps docs to them, and their words are counted once per venue. The
+representations can be computed by several forked processes, each with a
+chunk of the docs. """
 
 
 import json
 from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from multiprocessing import get_context
+
+
+representer = None  # set before forking, so that the workers inherit it
 
 
 class Representer:
@@ -21,23 +32,69 @@ class Representer:
     self.r_map = json.load(open(f'{folder}/ert/referees.json'))
     self.data = json.load(open(f'{folder}/data_lemmas_vocab.json'))
     self.w = .7  # weight of the venue in the doc's ERT
+    self.doc_venues = self.index_venues()
+    self.counters = [
+      {venue: Counter(words) for venue, words in arr.items()}
+      for arr in [self.venues, self.advisors, self.referees]
+    ]
+    self.venue_counter = lru_cache(maxsize=10000)(self.count_venue_words)
+
+  def index_venues(self):
+    """ Return a dict that maps each doc to its venues, advisors and referees,
+    in the order in which get_venues() used to find them. """
+    index = {}
+    for map in [self.v_map, self.a_map, self.r_map]:
+      for venue, docs in map.items():
+        for doc in dict.fromkeys(docs):  # each venue is added once per doc
+          index.setdefault(doc, []).append(venue)
+    return index
+
+  def get_representations(self, dump_file, n_procs=1, chunk_size=10000):
+    """ Compute the representations of all docs and dump them.
+    n_procs (int): no. of processes; if larger than one, the docs are split
+      into chunks of 'chunk_size' docs, which are represented by forked
+      processes. """
+    global representer
+    docs = list(self.data)
+    chunks = [docs[i:i+chunk_size] for i in range(0, len(docs), chunk_size)]
+    ert = {}
+    if n_procs > 1:
+      representer = self
+      with ProcessPoolExecutor(n_procs, mp_context=get_context('fork')) as ex:
+        for res in ex.map(represent_chunk, chunks):
+          ert.update(res)
+      representer = None
+    else:
+      for chunk in chunks:
+        ert.update(self.represent(chunk))
+    json.dump(ert, open(dump_file, 'w'))
 
-  def get_representations(self, dump_file):
+  def represent(self, docs):
+    """ Return the representations of the given docs as a dict. """
     ert = {}
-    for doc in self.data:
+    for doc in docs:
       venues = self.get_venues(doc)
-      venue_cnt = Counter(self.get_venue_words(venues))
+      venue_cnt = self.venue_counter(tuple(venues))
       doc_cnt = Counter(self.data[doc]['title'] + self.data[doc]['abstract'])
       ert[doc] = {'bow': self.concatenate(doc_cnt, venue_cnt), 'venues': venues}
-    json.dump(ert, open(dump_file, 'w'))
+    return ert
 
   def get_venues(self, doc):
     """ Return the venues, advisors and referees for the given doc. """
-    venues = []
-    for map in [self.v_map, self.a_map, self.r_map]:
-      venues += [v for v, docs in map.items() if doc in docs]
-    return venues
-  
+    return list(self.doc_venues.get(doc, []))
+
+  def count_venue_words(self, venues):
+    """ Return a counter with the words of the given venues. Called through
+    the LRU cache venue_counter(), as many docs share their venues. The
+    counters of the venues are added in the order in which get_venue_words()
+    concatenates their words, so that ties are sorted as before. """
+    cnt = Counter()
+    for counters in self.counters:
+      for venue in venues:
+        if venue in counters:
+          cnt.update(counters[venue])
+    return cnt
+
   def get_venue_words(self, venues):
     """ Concatenate the words of the venues and return them. """
     words = []
@@ -63,6 +120,12 @@ class Representer:
     return [w for w, _ in sorted(words.items(), key=lambda i: i[1], reverse=True)]
 
 
+def represent_chunk(docs):
+  """ Represent the given docs with the representer inherited from the parent
+  process. """
+  return representer.represent(docs)
+
+
 if __name__ == "__main__":
   dump_file = 'data/json/dim/all/ert/docs.json'
   repr = Representer()
@@ -1,36 +1,137 @@
 """ Helper class to retrieve the vector representation of a document, stored
-in one of multiple files. """
+in one of multiple files. These are the JSON files created by
+apply_embeddings.apply_segmented() and the shards of the sequence stores
+created by apply_embeddings.apply_ragged(). The location of each document is
+stored in an index file, which is only rebuilt when the files change, and the
+most recently used shards are kept in memory. """
 
 
+from functools import lru_cache
+from os import listdir, path, replace
 import json
-from os import listdir
+import re
+
+from sequence_store import SequenceStore
 
 
 class DocRetriever:
-  def __init__(self):
-    self.folder = 'data/vecs'
+  def __init__(self, folder='data/vecs', cache_size=4):
+    """ Load the index of the documents in the folder, or build it.
+    cache_size (int): no. of decoded shards kept in memory. """
+    self.folder = folder
+    self.index_file = f'{folder}/doc_index.json'
+    self.stores = self.find_stores()
     self.ids = self.retrieve_ids()
+    self.load_shard = lru_cache(maxsize=cache_size)(self.read_shard)
+
+  def find_stores(self):
+    """ Return the sequence stores of the folder, with the names of the meta
+    files as keys. A JSON file is a meta file if its first shard exists. """
+    stores = {}
+    for file in listdir(self.folder):
+      prefix = f'{self.folder}/{file[:-5]}'
+      if file.endswith('.json') and path.exists(f'{prefix}_1.rows.npy'):
+        stores[file] = SequenceStore(prefix)
+    return stores
+
+  def shard_files(self):
+    """ Return the JSON files with documents, i.e. those named 'docs_{n}.json'
+    by apply_embeddings.apply_segmented(). Other JSON files of the folder,
+    such as 'docs_sum.json', don't hold sequences of word vectors. """
+    return [
+      file for file in listdir(self.folder)
+      if re.fullmatch(r'docs_\d+\.json', file) and file not in self.stores
+    ]
+
+  def signature(self):
+    """ Return the size and modification time of the files with documents,
+    which determine whether the index is up to date. """
+    files = self.shard_files() + list(self.stores)
+    return {
+      file: [path.getsize(f'{self.folder}/{file}'),
+        path.getmtime(f'{self.folder}/{file}')]
+      for file in sorted(files)
+    }
 
   def retrieve_ids(self):
-    """ Store the location of all documents in a dictionary. """
+    """ Return a dict that maps each document to its shard and its position
+    within it. The shard of a JSON file is its name; the shard of a sequence
+    store is a tuple with the name of its meta file and the shard's number.
+    The index is loaded from the index file if the files haven't changed
+    since it was dumped, and otherwise built and dumped. The index is written
+    under a temporary name and renamed, and an unreadable index is rebuilt.
+    """
+    signature = self.signature()
+    index = None
+    if path.exists(self.index_file):
+      try:
+        index = json.load(open(self.index_file))
+      except json.JSONDecodeError:
+        pass
+      if index is not None and index['signature'] == signature:
+        return {
+          doc: (shard if isinstance(shard, str) else tuple(shard), row)
+          for doc, (shard, row) in index['ids'].items()
+        }
     ids = {}
-    for file in listdir(self.folder):
-      if 'docs' in file:
-        docs = json.load(open(f'{self.folder}/{file}'))
-        ids[file] = list(docs.keys())
+    for file in self.shard_files():
+      docs = json.load(open(f'{self.folder}/{file}'))
+      for row, doc in enumerate(docs):
+        ids[doc] = (file, row)
+    for file, store in self.stores.items():
+      for nr in range(1, store.n_shards+1):
+        for row, doc in enumerate(store.load_shard(nr)[0]):
+          ids[doc] = ((file, nr), row)
+    json.dump(
+      {'signature': signature, 'ids': ids},
+      open(f'{self.index_file}.tmp', 'w')
+    )
+    replace(f'{self.index_file}.tmp', self.index_file)
     return ids
-  
+
+  def read_shard(self, shard):
+    """ Decode the given shard. Called through the LRU cache load_shard(). """
+    if isinstance(shard, str):
+      return json.load(open(f'{self.folder}/{shard}'))
+    file, nr = shard
+    return self.stores[file].load_shard(nr)
+
   def get_vec(self, doc_id):
-    """ Given a document ID, return the corresponding vector. """
-    for file in self.ids:
-      if doc_id in self.ids[file]:
-        docs = json.load(open(f'{self.folder}/{file}'))
-        return docs[doc_id]
-  
+    """ Given a document ID, return the corresponding vector, or None if the
+    document is unknown. """
+    if doc_id not in self.ids:
+      return None
+    shard, row = self.ids[doc_id]
+    return self.resolve(shard, self.load_shard(shard), doc_id, row)
+
+  def get_vecs(self, doc_ids):
+    """ Return a dict with the vectors of the given documents. The documents
+    are grouped by shard, so that each shard is decoded at most once. Unknown
+    documents are left out. """
+    by_shard = {}
+    for doc_id in doc_ids:
+      if doc_id in self.ids:
+        shard, row = self.ids[doc_id]
+        by_shard.setdefault(shard, []).append((doc_id, row))
+    vecs = {}
+    for shard, docs in by_shard.items():
+      data = self.load_shard(shard)
+      for doc_id, row in docs:
+        vecs[doc_id] = self.resolve(shard, data, doc_id, row)
+    return vecs
+
+  def resolve(self, shard, data, doc_id, row):
+    """ Return the vector of the document from the decoded shard. Vectors of
+    sequence stores are numpy matrices, those of JSON files lists. """
+    if isinstance(shard, str):
+      return data[doc_id]
+    return self.stores[shard[0]].resolve(data, row)
+
   def items(self):
     """ Yield all docs and their vectors as tuples. """
-    for file in listdir(self.folder):
-      if 'docs' in file:
-        docs = json.load(open(f'{self.folder}/{file}'))
-        for doc, vec in docs.items():
-          yield (doc, vec)   
\ No newline at end of file
+    for file in self.shard_files():
+      docs = json.load(open(f'{self.folder}/{file}'))
+      for doc, vec in docs.items():
+        yield (doc, vec)
+    for store in self.stores.values():
+      yield from store.items()
@@ -0,0 +1,113 @@
+""" Store the word sequences of documents as rows of the embedding matrix
+instead of copies of the word vectors. Each shard holds a flat int32 array with
+the rows of the words of all its documents and an int64 array with the offset
+where each document starts (plus the total at the end), so that the vectors of
+a document are resolved against the embedding matrix when they are requested.
+Optionally, a shard also holds the resolved vectors as one float matrix with
+the same offsets, which can be quantized to float16 or int8 with a scale per
+word vector (see quantized.py) to reduce its size. All arrays are
+memory-mapped, and quantized vectors are converted to float32 when a
+document is resolved.
+
+The files of a store share a prefix: '{prefix}.json' holds the embeddings the
+rows refer to and the no. of docs of each shard, and the n-th shard consists
+of '{prefix}_{n}.ids.txt', '{prefix}_{n}.rows.npy', '{prefix}_{n}.offsets.npy'
+and, if materialized, '{prefix}_{n}.vecs.npy' (and, for int8, the scales in
+'{prefix}_{n}.vecs.scales.npy'). New documents are appended as new shards,
+without rewriting the existing ones. """
+
+
+import json
+import os
+
+import numpy as np
+
+from quantized import DTYPES, quantize, load_quantized
+from skipgram.embeddings import load_matrix
+
+
+class SequenceStore:
+  def __init__(self, prefix, vecs_file=None):
+    """ Open the store with the given prefix, or create it if it doesn't
+    exist, in which case vecs_file (JSON file or exported prefix of the
+    embeddings) is required. """
+    self.prefix = prefix
+    if os.path.exists(f'{prefix}.json'):
+      self.meta = json.load(open(f'{prefix}.json'))
+    elif vecs_file is None:
+      raise ValueError(f'No store at {prefix}; vecs_file is required')
+    else:
+      self.meta = {'vecs_file': vecs_file, 'shards': []}
+    self.idx, self.matrix = None, None  # loaded when needed
+
+  @property
+  def n_shards(self):
+    return len(self.meta['shards'])
+
+  def load_vecs(self):
+    """ Load the embeddings the rows refer to, if they aren't loaded yet. """
+    if self.matrix is None:
+      self.idx, self.matrix = load_matrix(self.meta['vecs_file'])
+
+  def append(self, docs, n=3000, materialize=False):
+    """ Append the documents as new shards with n documents each.
+    docs (dict): maps doc IDs to their lists of words, which must be present
+      in the vocab of the embeddings.
+    materialize (bool or str): whether to also store the resolved vectors,
+      as float32 if True or quantized if 'float16' or 'int8'. """
+    self.load_vecs()
+    ids = list(docs.keys())
+    for start in range(0, len(ids), n):
+      self.write_shard(ids[start:start+n], docs, materialize)
+
+  def write_shard(self, ids, docs, materialize):
+    """ Write the given documents as the next shard and update the meta file
+    once the shard is complete. """
+    path = f'{self.prefix}_{self.n_shards+1}'
+    lens = [len(docs[doc_id]) for doc_id in ids]
+    rows = np.fromiter(
+      (self.idx[w] for doc_id in ids for w in docs[doc_id]), dtype=np.int32,
+      count=sum(lens)
+    )
+    np.save(f'{path}.rows.npy', rows)
+    np.save(f'{path}.offsets.npy', np.concatenate([[0], np.cumsum(lens)]))
+    if materialize in DTYPES:
+      quantize(self.matrix[rows], materialize).save(f'{path}.vecs')
+    elif materialize:
+      np.save(f'{path}.vecs.npy', np.asarray(self.matrix[rows]))
+    with open(f'{path}.ids.txt', 'w', encoding='utf-8') as f:
+      for doc_id in ids:
+        f.write(doc_id + '\n')
+    self.meta['shards'].append(len(ids))
+    json.dump(self.meta, open(f'{self.prefix}.json', 'w'))
+
+  def load_shard(self, nr):
+    """ Return the IDs, rows, offsets and (if materialized, else None) vectors
+    of the nr-th shard, starting at 1. The arrays are memory-mapped; the
+    vectors are a QuantizedMatrix, which returns float32 rows. """
+    path = f'{self.prefix}_{nr}'
+    with open(f'{path}.ids.txt', encoding='utf-8') as f:
+      ids = f.read().split('\n')[:-1]
+    rows = np.load(f'{path}.rows.npy', mmap_mode='r')
+    offsets = np.load(f'{path}.offsets.npy', mmap_mode='r')
+    vecs = None
+    if os.path.exists(f'{path}.vecs.npy'):
+      vecs = load_quantized(f'{path}.vecs')
+    return ids, rows, offsets, vecs
+
+  def resolve(self, shard, i):
+    """ Return the matrix with the word vectors of the i-th document of the
+    given shard, as returned by load_shard(). """
+    _, rows, offsets, vecs = shard
+    start, end = offsets[i], offsets[i+1]
+    if vecs is not None:
+      return np.asarray(vecs[start:end])
+    self.load_vecs()
+    return np.asarray(self.matrix[rows[start:end]])
+
+  def items(self):
+    """ Yield all docs and their vector matrices as tuples. """
+    for nr in range(1, self.n_shards+1):
+      shard = self.load_shard(nr)
+      for i, doc_id in enumerate(shard[0]):
+        yield (doc_id, self.resolve(shard, i))
@@ -0,0 +1,87 @@
+""" Class that represents a corpus whose sentences have been encoded as vocab
+indices by prepare_data.encode_corpus(). The corpus consists of two arrays
+that share a prefix: '{prefix}.tokens.npy' holds the vocab indices of all the
+sentences one after the other (int32), and '{prefix}.offsets.npy' holds the
+position in which each sentence starts, plus the total no. of tokens at the
+end (int64). Both are memory-mapped, so the corpus is never loaded in RAM.
+
+A corpus may also be split into shards, e.g. by prepare_data.prepare_shards().
+Each shard is a corpus as described above, and a JSON file lists the prefixes
+of the shards in order; ShardedCorpus reads them as one corpus. """
+
+
+import json
+
+import numpy as np
+
+
+def load_corpus(data_file):
+  """ Return a ShardedCorpus if the data file is the JSON file that lists the
+  shards, and otherwise the Corpus with the given prefix. """
+  if data_file.endswith('.json'):
+    return ShardedCorpus(data_file)
+  return Corpus(data_file)
+
+
+class Corpus:
+  def __init__(self, prefix):
+    """ Memory-map the arrays of the corpus with the given prefix. """
+    self.tokens = np.load(f'{prefix}.tokens.npy', mmap_mode='r')
+    self.offsets = np.load(f'{prefix}.offsets.npy', mmap_mode='r')
+    self.n_sentences = len(self.offsets) - 1
+    self.n_tokens = len(self.tokens)
+
+  def __len__(self):
+    """ Return the number of sentences of the corpus. """
+    return self.n_sentences
+
+  def sentence(self, idx):
+    """ Return the vocab indices of the idx-th sentence as an array view. """
+    return self.tokens[self.offsets[idx]:self.offsets[idx+1]]
+
+  def chunk(self, start, end):
+    """ Return the vocab indices of the sentences from 'start' to 'end' as one
+    int64 array, and the lengths of the sentences. """
+    offsets = np.asarray(self.offsets[start:end+1])
+    tokens = np.asarray(self.tokens[offsets[0]:offsets[-1]], dtype=np.int64)
+    return tokens, np.diff(offsets)
+
+
+class ShardedCorpus:
+  def __init__(self, shards_file):
+    """ Memory-map the shards listed in the JSON file. Sentences are numbered
+    across shards, in the order of the list. """
+    self.shards = [Corpus(prefix) for prefix in json.load(open(shards_file))]
+    sizes = [len(shard) for shard in self.shards]
+    self.starts = np.cumsum([0] + sizes)  # first sentence of each shard
+    self.n_sentences = int(self.starts[-1])
+    self.n_tokens = sum(shard.n_tokens for shard in self.shards)
+
+  def __len__(self):
+    """ Return the number of sentences of the corpus. """
+    return self.n_sentences
+
+  def locate(self, idx):
+    """ Return the shard of the idx-th sentence and its index there. """
+    nr = int(np.searchsorted(self.starts, idx, side='right')) - 1
+    return self.shards[nr], idx - int(self.starts[nr])
+
+  def sentence(self, idx):
+    """ Return the vocab indices of the idx-th sentence as an array view. """
+    shard, i = self.locate(idx)
+    return shard.sentence(i)
+
+  def chunk(self, start, end):
+    """ Return the vocab indices of the sentences from 'start' to 'end' and
+    their lengths, as Corpus.chunk() does, joining the parts of each shard. """
+    tokens, lengths = [], []
+    for nr, shard in enumerate(self.shards):
+      first = max(start, int(self.starts[nr]))
+      last = min(end, int(self.starts[nr+1]))
+      if first < last:
+        part = shard.chunk(first - self.starts[nr], last - self.starts[nr])
+        tokens.append(part[0])
+        lengths.append(part[1])
+    if len(tokens) == 0:
+      return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    return np.concatenate(tokens), np.concatenate(lengths)
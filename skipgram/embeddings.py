@@ -0,0 +1,46 @@
+""" Class that gives access to the embeddings exported by
+utils.export_embeddings(). They consist of two files that share a prefix:
+'{prefix}.npy' holds the matrix with the input vectors of all words, and
+'{prefix}.words.txt' holds one word per line, in the order of the rows. The
+matrix is memory-mapped, so that loading the embeddings takes milliseconds
+and only the rows that are used are read from disk. """
+
+
+import json
+
+import numpy as np
+
+
+class Embeddings:
+  def __init__(self, prefix, mmap=True):
+    """ Load the embeddings with the given prefix.
+    mmap (bool): whether to memory-map the matrix instead of reading it. """
+    with open(f'{prefix}.words.txt', encoding='utf-8') as f:
+      self.words = f.read().split('\n')[:-1]
+    self.idx = {word: i for i, word in enumerate(self.words)}
+    self.matrix = np.load(f'{prefix}.npy', mmap_mode='r' if mmap else None)
+    self.n_words, self.n_dims = self.matrix.shape
+
+  def __contains__(self, word):
+    """ Return True if there is an embedding for the word. """
+    return word in self.idx
+
+  def __getitem__(self, word):
+    """ Return the embedding of the word as a list, like the values of the
+    JSON embedding files, so that both can be used interchangeably. """
+    return self.matrix[self.idx[word]].tolist()
+
+  def get_idx(self, word):
+    """ Return the row of the matrix that holds the embedding of the word. """
+    return self.idx[word]
+
+
+def load_matrix(vecs_file):
+  """ Return a dict that maps words to rows and the matrix of the embeddings
+  of the given JSON file (with words as keys) or exported prefix. """
+  if vecs_file.endswith('.json'):
+    vecs = json.load(open(vecs_file))
+    idx = {word: i for i, word in enumerate(vecs)}
+    return idx, np.array(list(vecs.values()))
+  vecs = Embeddings(vecs_file)
+  return vecs.idx, vecs.matrix
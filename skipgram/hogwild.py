@@ -0,0 +1,135 @@
+""" Train the skip-gram model with several CPU processes that update the same
+parameters without locks (Hogwild!), as the original word2vec tool does. The
+parameters are placed in shared memory and each process trains on its own
+shard of the data. The main process only collects the losses, logs them and
+saves the embeddings at the end of each epoch. If a process fails, it sends its
+traceback to the main process, which stops the others and raises an error. """
+
+
+from queue import Empty
+import logging
+import traceback
+
+import torch
+import torch.multiprocessing as mp
+from torch.utils.data import DataLoader
+
+from skipgram.train import ModelTrainer
+
+
+class HogwildTrainer(ModelTrainer):
+  def __init__(self, run_id, model, dataset, n_procs):
+    """ Initialize the trainer. The arguments are those of ModelTrainer.
+    n_procs (int): no. of training processes. """
+    super().__init__(run_id, model, dataset)
+    self.n_procs = n_procs
+    self.device = torch.device('cpu')
+    self.model.to(self.device)
+    self.model.share_memory()
+
+  def train(self, batch_size, n_epochs, lr, *, optimizer='sgd',
+      max_norm=None):
+    """ Start the training processes and aggregate their losses. The
+    processes are forked, so that they share the dataset and the model
+    without pickling them. At the end of each epoch, all processes wait at a
+    barrier until the embeddings have been saved. The arguments are those
+    of ModelTrainer.train(), which are keyword-only after lr; n_workers and
+    the checkpoints are not supported. The model must have sparse gradients
+    and the optimizer must be 'sgd': dense steps, and the private state of
+    Adam in each process, would overwrite whole tables updated by the others.
+    """
+    if optimizer != 'sgd' or not self.model.input_vectors.sparse:
+      raise ValueError('Hogwild training requires sparse gradients and sgd')
+    self.dataset.count_tokens()  # count them once, before forking
+    ctx = mp.get_context('fork')
+    queue = ctx.Queue()
+    barrier = ctx.Barrier(self.n_procs + 1)
+    args = (queue, barrier, batch_size, n_epochs, lr, optimizer, max_norm)
+    procs = [
+      ctx.Process(target=self.train_shard, args=(rank, *args))
+      for rank in range(self.n_procs)
+    ]
+    for proc in procs:
+      proc.start()
+    try:
+      for epoch in range(1, n_epochs+1):
+        self.cnt, self.current_loss = 0, 0  # for last 100 batches
+        self.epoch_cnt, self.epoch_loss = 0, 0  # for epoch
+        logging.info(f'Starting epoch {epoch} with {self.n_procs} processes')
+        finished = 0
+        while finished < self.n_procs:
+          loss = self.receive(queue, procs)
+          if loss is None:  # a process has finished its shard
+            finished += 1
+            continue
+          self.cnt += 1
+          self.current_loss -= loss
+          if self.cnt % 100 == 0:
+            self.log_loss()
+        self.log_loss(epoch=epoch)
+        barrier.wait()
+    except BaseException:
+      for proc in procs:
+        proc.terminate()
+      raise
+    for proc in procs:
+      proc.join()
+
+  def receive(self, queue, procs, timeout=1):
+    """ Return the next message of the processes: the loss of a batch or None.
+    A process that fails sends its traceback as a string, which is raised as
+    a RuntimeError. The queue is polled with a timeout, so that a process
+    that dies without sending it (e.g. killed by the OS) is detected by its
+    exit code. """
+    while True:
+      try:
+        msg = queue.get(timeout=timeout)
+      except Empty:
+        for proc in procs:
+          if proc.exitcode not in (None, 0):
+            raise RuntimeError(
+              f'Training process {proc.pid} exited with code {proc.exitcode}'
+            )
+        continue
+      if isinstance(msg, str):
+        raise RuntimeError(f'A training process failed:\n{msg}')
+      return msg
+
+  def train_shard(self, rank, queue, barrier, batch_size, n_epochs, lr,
+      optimizer, max_norm):
+    """ Train the model with the rank-th shard of the data. The loss of each
+    batch is sent to the main process, followed by None when the epoch is
+    over. Each process uses a single thread, as parallelism comes from the
+    processes. The lr decays with the progress of this process' shard. If the
+    training fails, the traceback is sent to the main process. """
+    try:
+      self.run_shard(
+        rank, queue, barrier, batch_size, n_epochs, lr, optimizer, max_norm
+      )
+    except Exception:
+      queue.put(traceback.format_exc())
+      raise
+
+  def run_shard(self, rank, queue, barrier, batch_size, n_epochs, lr,
+      optimizer, max_norm):
+    """ Training loop of train_shard(). """
+    torch.set_num_threads(1)
+    self.dataset.shard(rank, self.n_procs)
+    optimizer = self.get_optimizer(optimizer, lr)
+    decay = isinstance(optimizer, torch.optim.SGD)
+    n_tokens = self.dataset.count_tokens() / self.n_procs
+    epoch_pairs = n_tokens * 2 * self.dataset.window
+    done_pairs = 0
+    for epoch in range(1, n_epochs+1):
+      loader = DataLoader(
+        self.dataset, batch_size=None if self.dataset.batched else batch_size
+      )
+      for batch in loader:
+        if decay:
+          self.decay_lr(optimizer, lr, done_pairs / (epoch_pairs * n_epochs))
+        queue.put(self.step(optimizer, batch, max_norm).item())
+        done_pairs += len(batch[0])
+      queue.put(None)
+      self.dataset.reset()
+      epoch_pairs = done_pairs / epoch
+      barrier.wait()  # wait until the embeddings have been saved
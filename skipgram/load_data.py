@@ -1,33 +1,58 @@
 """ Lazily iterate over the data. The subsampling of frequent words occurs
-here. This class is an argument for PyTorch's DataLoader. """
+here. This class is an argument for PyTorch's DataLoader. The data is either
+a TXT file with one sentence per line or a corpus encoded with
+prepare_data.encode_corpus() or prepare_data.prepare_shards(), which is read
+through memory-mapped arrays.
+When the dataset is read by several DataLoader workers, each of them iterates
+over a disjoint part of the data. When it is read by the main process, its
+position can be stored with state_dict() and restored with load_state_dict(),
+so that an interrupted epoch resumes with the sample that follows the last one
+that was read. """
 
 
-from random import random, choices
+import os
 
-from torch.utils.data import IterableDataset
-from torch import LongTensor
+import numpy as np
+from torch.utils.data import IterableDataset, get_worker_info
+from torch import LongTensor, from_numpy
 
 from skipgram.vocab import Vocab
+from skipgram.corpus import load_corpus
+from skipgram.sampler import Sampler
 from skipgram.word import Word
 
 
 class Dataset(IterableDataset):
-  def __init__(self, vocab_file, data_file, k=15, w=2, t=10**-5):
+  batched = False  # the DataLoader has to batch the samples
+
+  def __init__(self, vocab_file, data_file, k=15, w=2, t=10**-5, seed=None):
     """ Initializes the dataset object, which is fed to PyTorch's DataLoader.
-    vocab_file (str): refers to a JSON file with the vocab. Used to initialize
-      the Vocab class.
-    data_file (str): refers to a TXT file with one sentence per line.
+    vocab_file (str): refers to a JSON file with the vocab or to the prefix of
+      a compiled vocab. Used to initialize the Vocab class.
+    data_file (str): refers to a TXT file with one sentence per line, to the
+      prefix of an encoded corpus or to the JSON file that lists the shards of
+      an encoded corpus (see skipgram.corpus).
     n_neg (int): no. of negative samples.
     window (int): no. of words (forwards and backwards) that form the context
     of a center word. They must belong to the same sentence as the center word.
-    discard_t (float): threshold used to subsample frequent words. """
+    discard_t (float): threshold used to subsample frequent words.
+    seed (int): seed of the random generators. Together with the epoch and the
+      shard, it determines the subsampling and the negative samples. If None,
+      the samples are not reproducible. """
     self.data_file = data_file
     self.vocab = Vocab(vocab_file)
-    self.data = open(data_file, encoding='utf-8')
+    self.sampler = Sampler(self.vocab.freqs)
+    self.corpus = None
+    if not data_file.endswith('.txt'):
+      self.corpus = load_corpus(data_file)
     self.n_neg = k
     self.window = w
     self.discard_t = t
-    self.get_sentence()
+    self.seed = seed
+    self.epoch = 0
+    self.shard_idx, self.n_shards = 0, 1
+    self.n_tokens = None  # computed by count_tokens()
+    self.resume = None  # state from which the next iteration starts
   
   def __len__(self):
     """ Return the number of words in the vocabulary. """
@@ -35,28 +60,139 @@ class Dataset(IterableDataset):
 
   def __iter__(self):
     """ Iterate over the samples. Negative samples are drawn for all pairs
-    that include the same center word. """
+    that include the same center word. The state of the random generator
+    before drawing them is stored, along with the no. of pairs of the center
+    that have been yielded, to be able to resume from any sample. """
+    skip = 0  # no. of pairs of the first center that were already yielded
+    if self.resume is None:
+      self.start()
+      self.get_sentence()
+    else:
+      skip = self.restore()
     while self.sentence is not None:
+      self.center_rng = self.rng.bit_generator.state
       neg_samples = self.sample(
         [self.center.vocab_idx] + [c.vocab_idx for c in self.context]
       )
-      for c in self.context:
+      for i, c in enumerate(self.context):
         this = neg_samples[:self.n_neg]
         neg_samples = neg_samples[self.n_neg:]
+        if i < skip:
+          continue
+        self.yielded = i + 1
         yield (self.center.vocab_idx, c.vocab_idx, LongTensor(this))
+      skip = 0
       self.step()
 
+  def state_dict(self):
+    """ Return the position of the iteration: the epoch, the position of the
+    current sentence in the file or corpus, the index of the center word, the
+    no. of its pairs that have been yielded and the state of the random
+    generator before its negative samples were drawn. Only meaningful when
+    the dataset is iterated in this process. """
+    state = {'epoch': self.epoch, 'sentence_pos': None}
+    if self.sentence is not None:
+      state.update({
+        'sentence_pos': self.sentence_pos,
+        'center': self.center.sentence_idx,
+        'yielded': self.yielded,
+        'rng': self.center_rng,
+      })
+    return state
+
+  def load_state_dict(self, state):
+    """ Resume the next iteration from the given state (see state_dict). """
+    self.epoch = state['epoch']
+    self.resume = state
+
+  def restore(self):
+    """ Move to the position stored in self.resume and return the no. of pairs
+    of the center word that must be skipped. """
+    state, self.resume = self.resume, None
+    self.start()
+    if state['sentence_pos'] is None:  # the shard was exhausted
+      self.sentence = None
+      return 0
+    if self.corpus is None:
+      self.data.seek(state['sentence_pos'])
+    else:
+      self.sentence_nr = state['sentence_pos']
+    self.get_sentence()
+    pos, w = state['center'], self.window
+    self.center = self.sentence[pos]
+    left = self.sentence[max(0, pos-w):pos]  # context as built by step()
+    self.context = left + self.sentence[pos+1:pos+w+1]
+    self.rng.bit_generator.state = state['rng']
+    return state['yielded']
+
+  def count_tokens(self):
+    """ Return the no. of tokens of the data. The TXT file is read to count
+    them the first time this is called. """
+    if self.corpus is not None:
+      return self.corpus.n_tokens
+    if self.n_tokens is None:
+      self.n_tokens = 0
+      for line in open(self.data_file, encoding='utf-8'):
+        self.n_tokens += line.count(' ') + 1
+    return self.n_tokens
+
+  def shard(self, idx, n):
+    """ Restrict the dataset to the idx-th of n disjoint shards of the data.
+    This is meant for processes that read the dataset without DataLoader
+    workers; the shard of each worker is computed in start(). """
+    self.shard_idx, self.n_shards = idx, n
+
+  def start(self):
+    """ Prepare the iteration over the shard of this process. If the dataset
+    is read by DataLoader workers, the shard is split further among them. A
+    TXT file is split into byte ranges, where a sentence belongs to the range
+    in which it starts; an encoded corpus is split into sentence ranges. The
+    random generator is seeded with the seed, the epoch and the shard, so
+    that each worker draws different samples. """
+    idx, n = self.shard_idx, self.n_shards
+    info = get_worker_info()
+    if info is not None:
+      idx, n = idx*info.num_workers + info.id, n*info.num_workers
+    if self.seed is None:
+      self.rng = np.random.default_rng()
+    else:
+      self.rng = np.random.default_rng([self.seed, self.epoch, idx])
+    self.sampler.rng = self.rng
+    if self.corpus is None:
+      size = os.path.getsize(self.data_file)
+      start, self.end = size*idx // n, size*(idx+1) // n
+      self.data = open(self.data_file, 'rb')
+      if start > 0:  # move to the first sentence that starts in the range
+        self.data.seek(start-1)
+        self.data.readline()
+    else:
+      n_sentences = len(self.corpus)
+      self.sentence_nr = n_sentences*idx // n
+      self.end = n_sentences*(idx+1) // n
+
   def get_sentence(self):
-    """ Read a line from the file and store its words as a list. Set the index
-    of the current center word to zero. """
-    line = self.data.readline()
-    if len(line) == 0:
+    """ Read a sentence from the file or the encoded corpus and store its words
+    as a list. Set the index of the current center word to zero. """
+    if self.corpus is None:
+      if self.data.tell() >= self.end:
+        self.sentence = None
+      else:
+        self.sentence_pos = self.data.tell()
+        line = self.data.readline().decode('utf-8')
+        words = line.replace('\n', '').split(' ')
+        self.sentence = [self.get_word(words, i) for i in range(len(words))]
+    elif self.sentence_nr >= self.end:
       self.sentence = None
     else:
-      words = line.replace('\n', '').split(' ')
-      self.sentence = [self.get_word(words, i) for i in range(len(words))]
+      ids = self.corpus.sentence(self.sentence_nr).tolist()
+      self.sentence_pos = self.sentence_nr
+      self.sentence_nr += 1
+      self.sentence = [
+        Word(self.vocab.entries[v], i, v) for i, v in enumerate(ids)
+      ]
+    if self.sentence is not None:
       self.center = self.sentence[0]  # center starts at the first word
-      until = self.window+1 if len(words) > self.window else len(words)
+      until = min(self.window+1, len(self.sentence))
       self.context = [self.sentence[i] for i in range(1, until)]
   
   def get_word(self, sentence, idx):
@@ -66,44 +202,138 @@ class Dataset(IterableDataset):
   
   def step(self):
     """ Move the center word to the left if possible and update the context.
-    If the end of the sentence has been reached, call get_sentence(). """
-    center_idx = self.center.sentence_idx + 1  # new center index
-    if center_idx == len(self.sentence):
-      self.get_sentence()
-    else:
+    If the end of the sentence has been reached, call get_sentence(). Repeat
+    while the new center word is discarded. This is done in a loop and not
+    recursively, as long runs of discarded words exceed the recursion limit. """
+    while True:
+      center_idx = self.center.sentence_idx + 1  # new center index
+      if center_idx == len(self.sentence):
+        self.get_sentence()
+        return
       if center_idx > self.window:  # left context is full
         self.context.pop(0)  # remove left-most word
         self.context[self.window-1] = self.center  # replace new center with old
       else:  # left context is not full; removal not necessary
         self.context[center_idx-1] = self.center  # insert old center
-      if center_idx < len(self.sentence) - self.window:  # update right context      
+      if center_idx < len(self.sentence) - self.window:  # update right context
         self.context.append(self.sentence[center_idx + self.window])
       self.center = self.sentence[center_idx]  # update center
-      if self.discard(self.center.word):
-        self.step()
+      if not self.discard(self.center.vocab_idx):
+        return
 
-  def discard(self, word):
+  def discard(self, vocab_idx):
     """ Discard sample with a probability 1 - sqrt(t/f(w)), where t is a
-    threshold defined in init and f(w) is the frequency of the word w. """
-    freq = self.vocab.get_word_freq(word)
+    threshold defined in init and f(w) is the frequency of the word w, given
+    by its index in the vocabulary. """
+    freq = self.vocab.get_idx_freq(vocab_idx)
     prob = 1 - (self.discard_t/freq)**.5
-    if random() > prob:
+    if self.rng.random() > prob:
       return True
     return False
   
   def sample(self, exclude):
     """ Sample 'n_neg' indices from the vocab. Exclude those present in the
     list 'exclude', which are the context words. The resulting indices are the
-    negative samples. the sampling functions follows the unigram distribution,
-    which is a weighted uniform distribution with the frequencies of the words
-    as weights. 'choices' samples with replacement. """
-    population = list(set(range(self.vocab.n_words)) - set(exclude))
-    freqs = [self.vocab.get_idx_freq(i) for i in population]
-    if len(population) > 0:
-      return choices(population, freqs, k=self.n_neg*self.window*2)
-    return []
+    negative samples. The sampling follows the unigram distribution, which is
+    a weighted uniform distribution with the frequencies of the words as
+    weights. Samples are drawn with replacement; excluded indices are rejected
+    by the sampler and drawn again. """
+    return self.sampler.sample(self.n_neg*self.window*2, exclude)
   
   def reset(self):
-    """ Reset the dataset. """
-    self.data = open(self.data_file, encoding='utf-8')
-    self.get_sentence()
+    """ Reset the dataset after an epoch. The data is read from the start in
+    the next call to __iter__, with generators seeded for the new epoch. """
+    self.epoch += 1
+
+
+class BatchDataset(Dataset):
+  batched = True  # the samples are already batched
+
+  def __init__(self, vocab_file, data_file, k=15, w=2, t=10**-5,
+      seed=None, batch_size=64, chunk_size=1000):
+    """ Dataset that yields whole batches instead of single samples. It reads
+    an encoded corpus (see skipgram.corpus) in chunks of 'chunk_size' sentences
+    and computes all pairs of a chunk at once with numpy. The remaining
+    arguments are those of Dataset.
+    batch_size (int): no. of pairs in each batch. The last batch of the data
+      may be smaller.
+    chunk_size (int): no. of sentences processed at once. """
+    if data_file.endswith('.txt'):
+      raise ValueError('BatchDataset requires an encoded corpus')
+    super().__init__(vocab_file, data_file, k, w, t, seed)
+    self.batch_size = batch_size
+    self.chunk_size = chunk_size
+
+  def __iter__(self):
+    """ Iterate over the batches. Each batch is a tuple with the indices of
+    the center words (N), the context words (N) and the negative samples
+    (N x k). Pairs that are left over from a chunk are carried over to the
+    next one, so that all batches except the last one are full. Before
+    yielding a batch, the pairs that are left and the next chunk are stored,
+    as they determine the position of the iteration. """
+    self.start()
+    if self.resume is None:
+      shapes = [0, 0, (0, self.n_neg)]
+      self.left = [np.empty(shape, dtype=np.int64) for shape in shapes]
+      start = self.sentence_nr
+    else:
+      state, self.resume = self.resume, None
+      self.left = [a.numpy() for a in state['left']]
+      self.rng.bit_generator.state = state['rng']
+      start = state['next_chunk']
+    left = self.left
+    while True:
+      while len(left[0]) >= self.batch_size:
+        batch = tuple(from_numpy(a[:self.batch_size]) for a in left)
+        left = [a[self.batch_size:] for a in left]
+        self.left, self.next_chunk = left, start
+        yield batch
+      if start >= self.end:
+        break
+      end = min(start + self.chunk_size, self.end)
+      pairs = self.get_pairs(start, end)
+      left = [np.concatenate([l, p]) for l, p in zip(left, pairs)]
+      start = end
+    if len(left[0]) > 0:
+      self.left, self.next_chunk = [a[:0] for a in left], self.end
+      yield tuple(from_numpy(a) for a in left)
+
+  def state_dict(self):
+    """ Return the position of the iteration: the epoch, the pairs that are
+    left for the next batch, the first sentence of the next chunk and the
+    state of the random generator, which is only used to compute chunks. """
+    return {
+      'epoch': self.epoch,
+      'left': [from_numpy(np.ascontiguousarray(a)) for a in self.left],
+      'next_chunk': self.next_chunk,
+      'rng': self.rng.bit_generator.state,
+    }
+
+  def get_pairs(self, start, end):
+    """ Compute the pairs of the sentences from 'start' to 'end' and their
+    negative samples. Center words are subsampled with a single random mask,
+    using the same probability as Dataset.discard(). A pair is formed for
+    each offset within the window whose word belongs to the same sentence as
+    the center. Negative samples that equal the center or the context word
+    of their pair are drawn again. Pairs are ordered by center word. """
+    tokens, lengths = self.corpus.chunk(start, end)
+    sentences = np.repeat(np.arange(end-start), lengths)
+    prob = 1 - (self.discard_t / self.vocab.freqs[tokens]) ** .5
+    keep = self.rng.random(len(tokens)) <= prob
+    positions = np.flatnonzero(keep)
+    centers, contexts = [], []
+    for offset in range(-self.window, self.window+1):
+      if offset == 0:
+        continue
+      ctx = positions + offset
+      valid = (ctx >= 0) & (ctx < len(tokens))
+      valid[valid] = sentences[ctx[valid]] == sentences[positions[valid]]
+      centers.append(positions[valid])
+      contexts.append(ctx[valid])
+    centers, contexts = np.concatenate(centers), np.concatenate(contexts)
+    order = np.argsort(centers, kind='stable')
+    centers, contexts = tokens[centers[order]], tokens[contexts[order]]
+    neg = self.sampler.sample_batch(
+      len(centers), self.n_neg, np.stack([centers, contexts], axis=1)
+    )
+    return centers, contexts, neg
@@ -0,0 +1,123 @@
+""" Record metrics of the training procedure and dump them to a JSON-lines
+file, one line per logging window: throughput in pairs and words per second,
+the time spent loading data and in the forward pass, the backward pass and the
+optimizer step, the learning rate, the avg. loss and the peak memory usage.
+Optionally, a range of batches is profiled with torch.profiler. """
+
+
+from contextlib import contextmanager
+from time import perf_counter
+import json
+import resource
+
+import torch
+
+
+STAGES = ('data', 'forward', 'backward', 'optimizer')
+
+
+class Metrics:
+  def __init__(self, dump_file=None, sync=False, profile_batches=None,
+      trace_file=None):
+    """ Initialize the metrics.
+    dump_file (str): JSON-lines file where the metrics are appended. If None,
+      the metrics are recorded but not dumped.
+    sync (bool): whether to synchronize CUDA before reading the clock, so that
+      stage timings are not attributed to later stages.
+    profile_batches (tuple): first and last (exclusive) batches that are
+      profiled with torch.profiler, counted over all epochs, or None.
+    trace_file (str): file where the profiler's chrome trace is exported. """
+    self.file = open(dump_file, 'a') if dump_file is not None else None
+    self.sync = sync
+    self.profile_batches = profile_batches
+    self.trace_file = trace_file
+    self.profiler = None
+    self.reset()
+
+  def reset(self):
+    """ Start a new logging window. """
+    self.start = perf_counter()
+    self.stages = {stage: 0 for stage in STAGES}
+    self.n_pairs, self.n_words = 0, 0
+
+  @contextmanager
+  def timer(self, stage):
+    """ Add the time spent in the 'with' block to the given stage. """
+    if self.sync:
+      torch.cuda.synchronize()
+    start = perf_counter()
+    yield
+    if self.sync:
+      torch.cuda.synchronize()
+    self.stages[stage] += perf_counter() - start
+
+  def add_batch(self, batch):
+    """ Count the pairs and center words of the batch. Pairs with the same
+    center word are contiguous, so that each change of the center word in the
+    batch marks a new word. """
+    centers = batch[0]
+    self.n_pairs += len(centers)
+    if len(centers) > 0:
+      self.n_words += int((centers[1:] != centers[:-1]).sum()) + 1
+
+  def dump(self, epoch, batch, loss, lr):
+    """ Dump the metrics of the current window and start a new one. All
+    values are plain numbers, so that no tensors are kept alive.
+    loss (float): avg. loss of the window.
+    lr (float): current learning rate. """
+    elapsed = perf_counter() - self.start
+    if self.file is not None:
+      self.file.write(json.dumps({
+        'epoch': epoch,
+        'batch': batch,
+        'loss': loss,
+        'lr': lr,
+        'pairs_per_sec': self.n_pairs / elapsed,
+        'words_per_sec': self.n_words / elapsed,
+        'seconds': {'total': elapsed, **self.stages},
+        'peak_rss_mb': peak_rss() / 1024,
+      }) + '\n')
+      self.file.flush()
+    self.reset()
+
+  def profile(self, batch):
+    """ Start or stop the profiler if the given batch is the first or the last
+    of the profiled range. """
+    if self.profile_batches is None:
+      return
+    first, last = self.profile_batches
+    if batch == first:
+      activities = [torch.profiler.ProfilerActivity.CPU]
+      if torch.cuda.is_available():
+        activities.append(torch.profiler.ProfilerActivity.CUDA)
+      self.profiler = torch.profiler.profile(activities=activities)
+      self.profiler.start()
+    elif batch == last:
+      self.stop_profile()
+
+  def close(self):
+    """ Stop the profiler and close the dump file. Called at the end of the
+    training; the metrics can also be used as a context manager. """
+    self.stop_profile()
+    if self.file is not None:
+      self.file.close()
+      self.file = None
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc_info):
+    self.close()
+
+  def stop_profile(self):
+    """ Stop the profiler, if it is running, and export its trace. Called by
+    close(), in case the training ends before the last profiled batch. """
+    if self.profiler is not None:
+      self.profiler.stop()
+      self.profiler.export_chrome_trace(self.trace_file)
+      self.profiler = None
+
+
+def peak_rss():
+  """ Return the peak resident set size of this process in KB (Linux). """
+  return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
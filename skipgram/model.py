@@ -7,19 +7,35 @@ import torch.nn.functional as F
 
 
 class Skipgram(nn.Module):
-  def __init__(self, n_words, n_dims):
+  def __init__(self, n_words, n_dims, sparse=False):
     """ Initializes the model.
     n_words (int): no. of words in the vocabulary.
     n_dims (int): no. of dimensions of each word.
+    sparse (bool): whether the gradients of the embeddings are sparse, i.e.
+      only include the rows of the words in the batch. Sparse gradients can
+      only be optimized with SparseAdam, SGD and a few other optimizers.
     """
     super(Skipgram, self).__init__()
     self.n_words = n_words
     self.n_dims = n_dims
-    self.input_vectors = nn.Embedding(n_words, n_dims)
-    self.output_vectors = nn.Embedding(n_words, n_dims)
+    self.input_vectors = nn.Embedding(n_words, n_dims, sparse=sparse)
+    self.output_vectors = nn.Embedding(n_words, n_dims, sparse=sparse)
     self.input_vectors.weight.data.uniform_(-1, 1)
     self.output_vectors.weight.data.uniform_(-1, 1)
 
+  def grow(self, n_words):
+    """ Extend both embedding tables to n_words rows, e.g. after new words
+    have been appended to the vocabulary. The rows of the existing words are
+    kept and the new ones are initialized as in __init__(). """
+    for name in ['input_vectors', 'output_vectors']:
+      old = getattr(self, name)
+      new = nn.Embedding(n_words, self.n_dims, sparse=old.sparse)
+      new.to(old.weight.device)
+      new.weight.data.uniform_(-1, 1)
+      new.weight.data[:self.n_words] = old.weight.data
+      setattr(self, name, new)
+    self.n_words = n_words
+
   def forward(self, input_idx, output_idx, neg_idx):
     """ Computes the forward pass.
     input_idx (tensor of size N): indices of the center words.
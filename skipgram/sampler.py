@@ -0,0 +1,57 @@
+""" Draw negative samples from the unigram distribution of the vocabulary. The
+cumulative distribution is computed once, so that drawing a sample costs a
+binary search instead of a pass over the whole vocabulary. """
+
+
+import numpy as np
+
+
+class Sampler:
+  def __init__(self, freqs, rng=None):
+    """ Initializes the sampler.
+    freqs (list or array): frequencies of the words in the vocabulary, ordered
+      by their index. They are the weights of the distribution; the vocab file
+      already contains the counts raised to 0.75 (see utils.compute_freqs).
+    rng (numpy Generator): random generator used to draw the samples. """
+    weights = np.asarray(freqs, dtype=np.float64)
+    self.cum_freqs = np.cumsum(weights)
+    self.cum_freqs /= self.cum_freqs[-1]
+    self.n_words = len(weights)
+    self.rng = rng if rng is not None else np.random.default_rng()
+
+  def draw(self, n):
+    """ Draw n indices from the distribution, with replacement. """
+    idx = np.searchsorted(self.cum_freqs, self.rng.random(n), side='right')
+    return np.minimum(idx, self.n_words-1)  # guard against rounding errors
+
+  def sample(self, n, exclude=()):
+    """ Draw n indices that are not present in 'exclude'. Excluded indices are
+    rejected and drawn again, which is cheap as long as they do not carry most
+    of the probability mass. If all words are excluded, return an empty array,
+    as Dataset.sample() used to do. """
+    exclude = np.asarray(list(exclude), dtype=np.int64)
+    if len(np.unique(exclude)) >= self.n_words:
+      return np.empty(0, dtype=np.int64)
+    samples = self.draw(n)
+    rejected = np.flatnonzero(np.isin(samples, exclude))
+    while len(rejected) > 0:
+      samples[rejected] = self.draw(len(rejected))
+      rejected = rejected[np.isin(samples[rejected], exclude)]
+    return samples
+
+  def sample_batch(self, n, k, exclude):
+    """ Draw k negative samples for each of n pairs. 'exclude' is an array of
+    shape (n, m) with the indices that must not be drawn for each pair, e.g.
+    the center and the context word. Returns an array of shape (n, k), which
+    is empty if there are no pairs, e.g. when a chunk's centers have all
+    been subsampled away. """
+    if n == 0:
+      return np.empty((0, k), dtype=np.int64)
+    exclude = np.asarray(exclude, dtype=np.int64).reshape(n, -1)
+    samples = self.draw(n*k).reshape(n, k)
+    rows, cols = np.nonzero((samples[:, :, None] == exclude[:, None]).any(2))
+    while len(rows) > 0:
+      samples[rows, cols] = self.draw(len(rows))
+      keep = (samples[rows, cols][:, None] == exclude[rows]).any(1)
+      rows, cols = rows[keep], cols[keep]
+    return samples
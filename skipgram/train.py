@@ -1,55 +1,202 @@
 """ Train the skip-gram model. """
 
 
+from time import time
 import logging
 import os
 import json
+import random
 
 import torch
 from torch.utils.data import DataLoader
 from torch.nn.utils import clip_grad_norm_
 
-from skipgram.load_data import Dataset
+from skipgram.load_data import Dataset, BatchDataset
 from skipgram.model import Skipgram
+from skipgram.metrics import Metrics
+from skipgram.utils import merge_counts, compute_freqs
+
+
+CHECKPOINT_COUNTERS = (
+  'cnt', 'current_loss', 'epoch_cnt', 'epoch_loss', 'n_batches',
+  'epoch_batches', 'done_pairs', 'epoch_pairs'
+)
 
 
 class ModelTrainer:
-  def __init__(self, run_id, model, dataset):
+  def __init__(self, run_id, model, dataset, metrics=None):
     """ Initialize the trainer. 
     run_id (int): ID of this training run; used to save embeddings.
     model (torch.nn): model to be trained.
-    dataset (torch's Dataset): dataset to be used. """
+    dataset (torch's Dataset): dataset to be used.
+    metrics (Metrics): records the throughput and timings of the training. If
+      None, they are recorded but not dumped. """
     self.run_id = run_id
     self.model = model
     self.dataset = dataset
     self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
     self.model.to(self.device)
+    self.metrics = metrics if metrics is not None else Metrics()
+
+  def train(self, batch_size, n_epochs, lr, *, n_workers=0, optimizer='adam',
+      max_norm=5, checkpoint=None, checkpoint_every=None,
+      checkpoint_minutes=None):
+    """ Train the model. If n_workers > 0, the samples are computed by that
+    many DataLoader workers, each reading its own part of the data, while
+    this process performs the optimization steps. The arguments after lr are
+    keyword-only, as subclasses support only some of them.
+    optimizer (str): 'adam', 'sparse_adam' or 'sgd'. The last two are meant
+      for models with sparse gradients, whose steps only touch the rows of
+      the words in the batch. With 'sgd', the learning rate decays linearly
+      over all epochs, as in the original word2vec.
+    max_norm (float): max. norm of the gradients; None disables clipping.
+      Clipping also works with sparse gradients.
+    checkpoint (dict): checkpoint created by save_checkpoint(), from which the
+      training is resumed.
+    checkpoint_every (int): write a checkpoint every n batches.
+    checkpoint_minutes (float): write a checkpoint every n minutes. """
+    optimizer = self.get_optimizer(optimizer, lr)
+    decay = isinstance(optimizer, torch.optim.SGD)
+    self.epoch_pairs = self.dataset.count_tokens() * 2 * self.dataset.window
+    self.done_pairs = 0  # no. of pairs processed; used to decay the lr
+    self.n_batches = 0  # no. of batches processed in all epochs
+    first_epoch, skip = 1, None
+    if checkpoint is not None:
+      first_epoch, skip = self.load_checkpoint(checkpoint, optimizer, n_workers)
+    last_checkpoint = time()
+    try:
+      for epoch in range(first_epoch, n_epochs+1):
+        loader = DataLoader(
+          self.dataset, num_workers=n_workers,
+          batch_size=None if self.dataset.batched else batch_size
+        )
+        batches = iter(loader)
+        if skip is None:
+          self.cnt, self.current_loss = 0, 0  # for last 100 batches
+          self.epoch_cnt, self.epoch_loss = 0, 0  # for epoch
+          self.epoch_batches = 0  # no. of batches processed in this epoch
+          logging.info(f'Starting epoch {epoch}')
+        else:  # resume the epoch where the checkpoint was written
+          logging.info(f'Resuming epoch {epoch} at batch {self.epoch_batches}')
+          for _ in range(skip):
+            next(batches)
+          skip = None
+        self.metrics.reset()
+        while True:
+          with self.metrics.timer('data'):
+            batch = next(batches, None)
+          if batch is None:
+            break
+          self.metrics.profile(self.n_batches)
+          if decay:
+            progress = self.done_pairs / (self.epoch_pairs * n_epochs)
+            self.decay_lr(optimizer, lr, progress)
+          loss = self.step(optimizer, batch, max_norm)
+          self.metrics.add_batch(batch)
+          self.done_pairs += len(batch[0])
+          self.n_batches += 1
+          self.epoch_batches += 1
+          self.cnt += 1
+          self.current_loss -= loss.item()  # a float doesn't keep the graph
+          if self.cnt % 100 == 0:
+            self.dump_metrics(epoch, self.n_batches, optimizer)
+            self.log_loss()
+          if (checkpoint_every is not None and
+              self.n_batches % checkpoint_every == 0) or (
+              checkpoint_minutes is not None and
+              time() - last_checkpoint >= 60 * checkpoint_minutes):
+            self.save_checkpoint(epoch, optimizer, n_workers)
+            last_checkpoint = time()
+        if self.cnt > 0:
+          self.dump_metrics(epoch, self.n_batches, optimizer)
+        self.log_loss(epoch=epoch)
+        self.dataset.reset()
+        self.epoch_pairs = self.done_pairs / epoch  # replace the estimate
+    finally:  # also when the training fails
+      self.metrics.close()
+
+  def save_checkpoint(self, epoch, optimizer, n_workers):
+    """ Write a checkpoint with everything needed to resume the training from
+    this point: the model, the optimizer, the epoch, the counters of the
+    trainer, the position of the dataset and the states of the random
+    generators. The file is written under a temporary name and then renamed,
+    so that an interruption never leaves a corrupt checkpoint. If the data
+    is read by DataLoader workers, their position is unknown to this process
+    and the batches of the epoch are skipped when resuming instead; this is
+    only exact if the dataset has a seed. """
+    folder = f'skipgram/embeddings/{self.run_id}'
+    os.makedirs(folder, exist_ok=True)
+    state = {
+      'epoch': epoch,
+      'model': self.model.state_dict(),
+      'optimizer': optimizer.state_dict(),
+      'counters': {key: getattr(self, key) for key in CHECKPOINT_COUNTERS},
+      'dataset': self.dataset.state_dict() if n_workers == 0 else None,
+      'dataset_epoch': self.dataset.epoch,
+      'torch_rng': torch.get_rng_state(),
+      'python_rng': random.getstate(),
+    }
+    torch.save(state, f'{folder}/checkpoint.pt.tmp')
+    os.replace(f'{folder}/checkpoint.pt.tmp', f'{folder}/checkpoint.pt')
+    logging.info(f'Checkpoint written at batch {self.epoch_batches}')
+
+  def load_checkpoint(self, checkpoint, optimizer, n_workers):
+    """ Restore the state stored by save_checkpoint(). Return the epoch that
+    is resumed and the no. of its batches that the loader has to skip. """
+    self.model.load_state_dict(checkpoint['model'])
+    optimizer.load_state_dict(checkpoint['optimizer'])
+    for key, value in checkpoint['counters'].items():
+      setattr(self, key, value)
+    torch.set_rng_state(checkpoint['torch_rng'])
+    random.setstate(checkpoint['python_rng'])
+    if checkpoint['dataset'] is not None and n_workers == 0:
+      self.dataset.load_state_dict(checkpoint['dataset'])
+      return checkpoint['epoch'], 0
+    self.dataset.epoch = checkpoint['dataset_epoch']
+    return checkpoint['epoch'], self.epoch_batches
+
+  def step(self, optimizer, batch, max_norm):
+    """ Perform an optimization step with the batch and return its loss. The
+    time spent in each stage is added to the metrics. """
+    with self.metrics.timer('forward'):
+      optimizer.zero_grad()
+      loss = -self.model(*[t.to(self.device) for t in batch])
+    with self.metrics.timer('backward'):
+      loss.backward()
+      if max_norm is not None:
+        clip_grad_norm_(self.model.parameters(), max_norm=max_norm)
+    with self.metrics.timer('optimizer'):
+      optimizer.step()
+    return loss
 
-  def train(self, batch_size, n_epochs, lr):
-    optimizer = torch.optim.Adam(self.model.parameters(), lr=lr)
-    for epoch in range(1, n_epochs+1):
-      loader = DataLoader(self.dataset, batch_size=batch_size)
-      self.cnt, self.current_loss = 0, 0  # for last 100 batches
-      self.epoch_cnt, self.epoch_loss = 0, 0  # for epoch
-      logging.info(f'Starting epoch {epoch}')
-      for batch in loader:
-        optimizer.zero_grad()
-        loss = -self.model(*[t.to(self.device) for t in batch])
-        loss.backward()
-        clip_grad_norm_(self.model.parameters(), max_norm=5)
-        optimizer.step()
-        self.cnt += 1
-        self.current_loss -= loss
-        if self.cnt % 100 == 0:
-          self.log_loss()
-      self.log_loss(epoch=epoch)
-      self.dataset.reset()
+  def dump_metrics(self, epoch, n_batches, optimizer):
+    """ Dump the metrics of the batches since the last call, together with
+    their avg. loss and the current learning rate. """
+    lr = optimizer.param_groups[0]['lr']
+    self.metrics.dump(epoch, n_batches, -self.current_loss / self.cnt, lr)
+
+  def decay_lr(self, optimizer, lr, progress):
+    """ Decrease the initial lr linearly with the progress of the training,
+    which goes from 0 to 1, down to 1e-4 times the initial lr. """
+    for group in optimizer.param_groups:
+      group['lr'] = lr * max(1 - progress, 10**-4)
+
+  def get_optimizer(self, name, lr):
+    """ Return the optimizer with the given name (see train()). """
+    if name == 'adam':
+      return torch.optim.Adam(self.model.parameters(), lr=lr)
+    if name == 'sparse_adam':
+      return torch.optim.SparseAdam(list(self.model.parameters()), lr=lr)
+    if name == 'sgd':
+      return torch.optim.SGD(self.model.parameters(), lr=lr)
+    raise ValueError(f'Unknown optimizer: {name}')
   
   def log_loss(self, epoch=-1):
     """ If epoch=-1: log avg. loss of the last 100 batches. Before resetting
     the cnt and current_loss, add them to the totals for the epoch.
     Else: epoch has ended - log its avg. loss, set all counters to zero
-    and call save_embeddings(). """
+    and call save_embeddings(). current_loss holds the negated sum of the
+    losses, which are logged as positive values, as in the metrics file. """
     self.epoch_loss -= self.current_loss
     self.epoch_cnt += self.cnt
     if epoch > 0:
@@ -59,7 +206,7 @@ class ModelTrainer:
       self.epoch_cnt = 0
       self.save_embeddings(epoch)
     else:
-      avg_loss = self.current_loss / self.cnt
+      avg_loss = -self.current_loss / self.cnt
       logging.info(f'Avg. loss in the last 100 batches: {avg_loss}')
     self.cnt = 0
     self.current_loss = 0
@@ -79,10 +226,30 @@ class ModelTrainer:
       
 
 def init_training(run_id, vocab_file, data_file, neg_samples, window,
-    n_dims, batch_size=32, n_epochs=5, lr=.002, model_file=None):
+    n_dims, batch_size=32, n_epochs=5, lr=.002, model_file=None,
+    batched=False, n_workers=0, seed=None, sparse=False, optimizer='adam',
+    max_norm=5, n_procs=1, metrics_file=None, profile_batches=None,
+    checkpoint_file=None, checkpoint_every=None, checkpoint_minutes=None):
   """ Configure logging, log the parameters of this training procedure and
   initialize training. If model file is given, initialize the model parameters
-  with it. Training will be restarted from that point on. """
+  with it. Training will be restarted from that point on. If batched is True,
+  the data file must be an encoded corpus, whose pairs are computed for whole
+  batches at once (see load_data.BatchDataset). n_workers is the no. of
+  DataLoader workers that compute the samples. The seed makes the samples
+  reproducible. If sparse is True, the embeddings have sparse gradients and
+  the optimizer should be 'sparse_adam' or 'sgd' (see ModelTrainer.train).
+  If the model file was trained with a smaller vocab, to which new words have
+  been appended, the model is grown (see load_model). If n_procs > 1, the
+  model is trained by that many CPU processes that update it without locks
+  (see skipgram.hogwild), which requires sparse=True and optimizer='sgd';
+  n_workers, the metrics, the profiling and the checkpoints are not
+  supported then, and a warning is logged if they are set. The metrics of the
+  training are dumped to the metrics file, if given, and the batches in the
+  range 'profile_batches' are profiled (see skipgram.metrics).
+  Checkpoints are written every 'checkpoint_every' batches and/or every
+  'checkpoint_minutes' minutes. If a checkpoint file is given, the training is
+  resumed exactly where that checkpoint was written; the remaining parameters
+  must be those of the interrupted run. """
   logging.info('Training embeddings with the following parameters:')
   logging.info(f'Vocab file: {vocab_file}')
   logging.info(f'Data file: {data_file}')
@@ -90,10 +257,93 @@ def init_training(run_id, vocab_file, data_file, neg_samples, window,
   logging.info(f'No. of context words at each side: {window}')
   logging.info(f'Batch size: {batch_size}')
   logging.info(f'No. of dimensions of the embeddings: {n_dims}')
-  dataset = Dataset(vocab_file, data_file, k=neg_samples, w=window)
+  logging.info(f'No. of DataLoader workers: {n_workers}')
+  logging.info(f'Optimizer: {optimizer} (sparse gradients: {sparse})')
+  if batched:
+    dataset = BatchDataset(
+      vocab_file, data_file, k=neg_samples, w=window, seed=seed,
+      batch_size=batch_size
+    )
+  else:
+    dataset = Dataset(vocab_file, data_file, k=neg_samples, w=window, seed=seed)
   logging.info(f'Dataset has {dataset.vocab.n_words} words\n\n')
-  model = Skipgram(dataset.vocab.n_words, n_dims)
   if model_file is not None:
-    model.load_state_dict(torch.load(model_file))
-  trainer = ModelTrainer(run_id, model, dataset)
-  trainer.train(batch_size, n_epochs, lr)
+    model = load_model(model_file, dataset.vocab, n_dims, sparse)
+  else:
+    model = Skipgram(dataset.vocab.n_words, n_dims, sparse=sparse)
+  if n_procs > 1:
+    from skipgram.hogwild import HogwildTrainer  # it imports this module
+    if not sparse or optimizer != 'sgd':
+      raise ValueError('Hogwild training requires sparse=True and sgd')
+    ignored = [name for name, value in [
+      ('n_workers', n_workers), ('metrics_file', metrics_file),
+      ('profile_batches', profile_batches),
+      ('checkpoint_file', checkpoint_file),
+      ('checkpoint_every', checkpoint_every),
+      ('checkpoint_minutes', checkpoint_minutes)] if value]
+    if len(ignored) > 0:
+      logging.warning(f'Ignored by Hogwild training: {", ".join(ignored)}')
+    logging.info(f'Hogwild training with {n_procs} processes')
+    trainer = HogwildTrainer(run_id, model, dataset, n_procs)
+    trainer.train(
+      batch_size, n_epochs, lr, optimizer=optimizer, max_norm=max_norm
+    )
+  else:
+    metrics = Metrics(
+      metrics_file, torch.cuda.is_available(), profile_batches,
+      f'logs/{run_id}_trace.json'
+    )
+    trainer = ModelTrainer(run_id, model, dataset, metrics)
+    checkpoint = None
+    if checkpoint_file is not None:
+      logging.info(f'Resuming from checkpoint: {checkpoint_file}')
+      checkpoint = torch.load(checkpoint_file)
+    trainer.train(
+      batch_size, n_epochs, lr, n_workers=n_workers, optimizer=optimizer,
+      max_norm=max_norm, checkpoint=checkpoint,
+      checkpoint_every=checkpoint_every, checkpoint_minutes=checkpoint_minutes
+    )
+
+
+def load_model(model_file, vocab, n_dims, sparse=False):
+  """ Load the model stored in the model file. If it has less words than the
+  vocab, new words have been appended to the vocab since it was trained, and
+  the embedding tables are grown to the size of the vocab. If the words of
+  the model's run are stored next to it (see save_embeddings), they must be
+  the first words of the vocab. """
+  state = torch.load(model_file)
+  n_words = state['input_vectors.weight'].shape[0]
+  model = Skipgram(n_words, n_dims, sparse=sparse)
+  model.load_state_dict(state)
+  entries_file = f'{os.path.dirname(model_file)}/entries.json'
+  if os.path.exists(entries_file):
+    entries = json.load(open(entries_file, encoding='utf-8'))
+    if entries != vocab.entries[:len(entries)]:
+      raise ValueError('The words of the model are not a prefix of the vocab')
+  if n_words < vocab.n_words:
+    logging.info(f'Growing the model from {n_words} to {vocab.n_words} words')
+    model.grow(vocab.n_words)
+  return model
+
+
+def continue_training(run_id, count_file, new_count_file, merged_count_file,
+    vocab_file, model_file, data_file, neg_samples, window, n_dims,
+    n_passes=1, **kwargs):
+  """ Update trained embeddings with new documents instead of training them
+  from scratch. The counts of the new documents are added to those of the
+  count file and dumped to the merged count file, from which the frequencies
+  of the vocab file are computed again, which appends the new words to the
+  vocab. The count file is left as it is, so that running this function again
+  (e.g. after a failed training) doesn't count the new documents twice. The
+  model is then grown and trained for 'n_passes' epochs on the data file,
+  which should only contain the sentences of the new or changed documents
+  (see prepare_data.py). The remaining arguments are those of
+  init_training(). """
+  if merged_count_file == count_file:
+    raise ValueError('The merged counts must not overwrite the count file')
+  merge_counts(count_file, new_count_file, merged_count_file)
+  compute_freqs(merged_count_file, vocab_file)
+  init_training(
+    run_id, vocab_file, data_file, neg_samples, window, n_dims,
+    n_epochs=n_passes, model_file=model_file, **kwargs
+  )
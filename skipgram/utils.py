@@ -3,9 +3,12 @@ and its training. """
 
 
 import json
+
+import numpy as np
 import torch
 
 from skipgram.model import Skipgram
+from skipgram.vocab import Vocab
 
 
 def get_embeddings(timestamp, epoch, n_dims, dump_file):
@@ -21,11 +24,42 @@ def get_embeddings(timestamp, epoch, n_dims, dump_file):
   entries = json.load(open(f'{folder}/entries.json', encoding='utf-8'))
   model = Skipgram(len(entries), n_dims)
   model.load_state_dict(torch.load(f'{folder}/epoch_{epoch}.pt'))
-  vecs = {entries[i]: model.input_vectors(torch.LongTensor([i])).tolist()[0] 
-      for i in range(len(entries))}
+  matrix = model.input_vectors.weight.tolist()
+  vecs = {entries[i]: matrix[i] for i in range(len(entries))}
   json.dump(vecs, open(dump_file, 'w', encoding='utf-8'))
 
 
+def export_embeddings(timestamp, epoch, n_dims, dump_prefix, dtype='float32'):
+  """ Export the embeddings like get_embeddings(), but as a matrix in a .npy
+  file with the words in a separate file, which can be memory-mapped by the
+  Embeddings class (see skipgram.embeddings). The arguments are those of
+  get_embeddings(), except for:
+  dump_prefix (str): prefix of the files where the results are stored.
+  dtype (str): 'float32' or 'float16', which halves the size of the file. """
+  folder = f'skipgram/embeddings/{timestamp}'
+  entries = json.load(open(f'{folder}/entries.json', encoding='utf-8'))
+  model = Skipgram(len(entries), n_dims)
+  model.load_state_dict(torch.load(f'{folder}/epoch_{epoch}.pt'))
+  matrix = model.input_vectors.weight.detach().numpy().astype(dtype)
+  np.save(f'{dump_prefix}.npy', matrix)
+  with open(f'{dump_prefix}.words.txt', 'w', encoding='utf-8') as f:
+    for word in entries:
+      f.write(word + '\n')
+
+
+def save_word2vec(embeddings, dump_file):
+  """ Write the embeddings in the binary format of the word2vec tool, which
+  is understood by other libraries: a header with the no. of words and
+  dimensions, followed by each word and its vector as float32 bytes.
+  embeddings (Embeddings): embeddings exported by export_embeddings().
+  dump_file (str): file where the result should be dumped. """
+  with open(dump_file, 'wb') as f:
+    f.write(f'{embeddings.n_words} {embeddings.n_dims}\n'.encode('utf-8'))
+    for i, word in enumerate(embeddings.words):
+      vec = np.asarray(embeddings.matrix[i], dtype='<f4')
+      f.write(word.encode('utf-8') + b' ' + vec.tobytes() + b'\n')
+
+
 def compute_freqs(count_file, dump_file, power=.75):
   """Compute the frequencies of the counts raised to the given power. 
   count_file (str): file with the dictionary with words and their counts.
@@ -36,4 +70,27 @@ def compute_freqs(count_file, dump_file, power=.75):
   vocab = {word: cnt**power for word, cnt in vocab.items()}
   total = sum(vocab.values())
   vocab = {word: cnt/total for word, cnt in vocab.items()}
-  json.dump(vocab, open(dump_file, 'w', encoding='utf-8'))
\ No newline at end of file
+  json.dump(vocab, open(dump_file, 'w', encoding='utf-8'))
+
+
+def merge_counts(count_file, new_count_file, dump_file):
+  """ Add the word counts of the new file to those of the count file. The
+  words of the count file keep their positions and new words are appended,
+  so that the vocab computed from the result with compute_freqs() keeps the
+  indices of the old one and the embeddings can be grown (see Skipgram.grow).
+  count_file (str): file with the dictionary with words and their counts.
+  new_count_file (str): file with the counts of the new documents.
+  dump_file (str): file where the result should be dumped. """
+  counts = json.load(open(count_file, encoding='utf-8'))
+  new_counts = json.load(open(new_count_file, encoding='utf-8'))
+  for word, cnt in new_counts.items():
+    counts[word] = counts.get(word, 0) + cnt
+  json.dump(counts, open(dump_file, 'w', encoding='utf-8'))
+
+
+def compile_vocab(vocab_file, dump_prefix):
+  """ Store the vocab of the given JSON file in the compiled form described
+  in skipgram.vocab, which loads faster and can be memory-mapped.
+  vocab_file (str): JSON file with the words and their frequencies or counts.
+  dump_prefix (str): prefix of the files where the result should be dumped. """
+  Vocab(vocab_file).save(dump_prefix)
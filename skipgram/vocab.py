@@ -1,32 +1,64 @@
 """ Class that represents the vocabulary, with functions to get the index of a
-word and the word found in the vocabulary at a given index. """
+word and the word found in the vocabulary at a given index.
+
+The vocabulary can be read from a JSON file (an ordered dict with the words as
+keys and their frequencies as values) or from its compiled form, which is
+created with save() and consists of two files that share a prefix:
+'{prefix}.words.txt' holds one word per line, ordered by index, and
+'{prefix}.freqs.npy' holds the frequencies in the same order. The compiled
+form loads faster and its frequencies can be memory-mapped. """
 
 
 import json
 
+import numpy as np
+
 
 class Vocab:
-  def __init__(self, vocab_file):
-    """ The vocabulary is an ordered dict with the words as keys and their
-    frequencies in the data as values. The index of a word is its position
-    in the dictionary. """
-    self.vocab = json.load(open(vocab_file, encoding='utf-8'))
-    self.entries = list(self.vocab.keys())  # list of words in the vocabulary
+  def __init__(self, vocab_file, mmap=False):
+    """ The index of a word is its position in the vocabulary. Words are mapped
+    to their indices with a dict and frequencies are stored in an array, so
+    that all look-ups take constant time.
+    vocab_file (str): JSON file or prefix of the compiled vocabulary.
+    mmap (bool): whether to memory-map the frequencies of a compiled vocab. """
+    if vocab_file.endswith('.json'):
+      vocab = json.load(open(vocab_file, encoding='utf-8'))
+      self.entries = list(vocab.keys())  # list of words in the vocabulary
+      self.freqs = np.array(list(vocab.values()), dtype=np.float64)
+    else:
+      with open(f'{vocab_file}.words.txt', encoding='utf-8') as f:
+        self.entries = f.read().split('\n')[:-1]
+      self.freqs = np.load(
+        f'{vocab_file}.freqs.npy', mmap_mode='r' if mmap else None
+      )
+    self.idx = {word: i for i, word in enumerate(self.entries)}
     self.n_words = len(self.entries)  # number of words in the vocabulary
-  
+
+  def __contains__(self, word):
+    """ Return True if the word is part of the vocabulary. """
+    return word in self.idx
+
   def get_idx(self, word):
     """ Return the index of the word in the vocabulary. """
-    return self.entries.index(word)
-  
+    return self.idx[word]
+
   def get_word(self, idx):
     """ Return the word in the vocabulary at the given index. """
     return self.entries[idx]
-  
+
   def get_idx_freq(self, idx):
     """ Return the frequency of the word in the vocabulary at the given
     index. """
-    return self.vocab[self.get_word(idx)]
-  
+    return self.freqs[idx]
+
   def get_word_freq(self, word):
     """ Return the frequency of the given word. """
-    return self.vocab[word]
+    return self.freqs[self.idx[word]]
+
+  def save(self, prefix):
+    """ Store the vocabulary in its compiled form (see the module docstring).
+    """
+    with open(f'{prefix}.words.txt', 'w', encoding='utf-8') as f:
+      for word in self.entries:
+        f.write(word + '\n')
+    np.save(f'{prefix}.freqs.npy', np.asarray(self.freqs))
@@ -0,0 +1,26 @@
+""" Fixtures shared by the tests: a small synthetic dataset (see
+benchmarks.synthetic), generated once and copied for each test. """
+
+
+import shutil
+
+import pytest
+
+from benchmarks.synthetic import generate
+
+
+@pytest.fixture(scope='session')
+def synthetic_dir(tmp_path_factory):
+  """ Generate the synthetic dataset once for all tests. """
+  folder = tmp_path_factory.mktemp('synthetic')
+  generate(folder, n_docs=300, n_words=1000, n_subjects=100, n_dims=16)
+  return folder
+
+
+@pytest.fixture
+def dataset(synthetic_dir, tmp_path, monkeypatch):
+  """ Copy the synthetic dataset to a new folder and make it the working
+  directory, as the scripts use paths relative to it. """
+  shutil.copytree(synthetic_dir / 'data', tmp_path / 'data')
+  monkeypatch.chdir(tmp_path)
+  return tmp_path
@@ -0,0 +1,65 @@
+""" Tests of the subject assignment with the summed doc vectors. """
+
+
+from os import path
+import json
+
+import pytest
+
+from apply_embeddings import apply_sum_matrix
+from assign_subjects import find_fields_sum, find_subjects_sum
+import assign_subjects
+from retrieve_docs import DocRetriever
+
+
+def prepare_sum():
+  """ Compute the summed doc vectors and their closest fields. """
+  apply_sum_matrix(
+    'data/bow/docs.json', 'data/vecs/embeddings.json', 'data/vecs/docs_sum'
+  )
+  find_fields_sum('data/distances/sum/l0_distances.json')
+
+
+def test_quantized_files_are_not_docs(dataset):
+  """ The files of the quantized doc matrix aren't indexed as docs. """
+  docs = json.load(open('data/bow/docs.json'))
+  prepare_sum()
+  find_subjects_sum(dtype='int8')
+  retriever = DocRetriever()
+  assert set(retriever.ids) == set(docs)
+  assert {doc for doc, _ in retriever.items()} == set(docs)
+
+
+def test_rerun_with_other_parameters(dataset):
+  """ A finished run doesn't leave a resume file behind, and a new run with
+  other parameters computes all docs again. """
+  prepare_sum()
+  dump_file = 'data/distances/sum/top_50_subjects.json'
+  find_subjects_sum(n=20)
+  assert not path.exists('data/distances/sum/top_50_subjects.jsonl')
+  assert max(len(d) for d in json.load(open(dump_file)).values()) == 20
+  find_subjects_sum(n=3)
+  assert max(len(d) for d in json.load(open(dump_file)).values()) == 3
+
+
+def test_resume_only_with_same_parameters(dataset, monkeypatch):
+  """ The resume file of an interrupted run is used by a run with the same
+  parameters and discarded by a run with other parameters. """
+  prepare_sum()
+  jsonl_file = 'data/distances/sum/top_50_subjects.jsonl'
+  dump_file = 'data/distances/sum/top_50_subjects.json'
+
+  def interrupt(jsonl_file, dump_file):
+    """ Stop the run after all docs have been written. """
+    raise KeyboardInterrupt
+
+  for n in [20, 3, 20]:
+    with monkeypatch.context() as patch, pytest.raises(KeyboardInterrupt):
+      patch.setattr(assign_subjects, 'collect', interrupt)
+      find_subjects_sum(n=n)
+    lines = open(jsonl_file).readlines()
+    assert len(lines) > 1 and f'"n": {n},' in lines[0]
+  find_subjects_sum(n=20)  # resumed: all docs are done
+  assert max(len(d) for d in json.load(open(dump_file)).values()) == 20
+  find_subjects_sum(n=3)
+  assert max(len(d) for d in json.load(open(dump_file)).values()) == 3
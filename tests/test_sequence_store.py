@@ -0,0 +1,26 @@
+""" Tests of the sequence store with quantized vectors. """
+
+
+import numpy as np
+import pytest
+
+from apply_embeddings import apply_ragged
+from sequence_store import SequenceStore
+
+
+@pytest.mark.parametrize('dtype, tol', [('float16', 1e-3), ('int8', 1e-2)])
+def test_quantized_vectors(dataset, dtype, tol):
+  """ The quantized vectors of a materialized store are close to those of a
+  store without them, and take less space. """
+  for prefix, materialize in [('exact', False), ('quant', dtype)]:
+    apply_ragged(
+      'data/bow/docs.json', 'data/vecs/embeddings.json', f'data/{prefix}',
+      100, materialize
+    )
+  exact, quant = SequenceStore('data/exact'), SequenceStore('data/quant')
+  for (id1, vecs1), (id2, vecs2) in zip(exact.items(), quant.items()):
+    assert id1 == id2 and vecs2.dtype == np.float32
+    assert vecs1.shape == vecs2.shape
+    if len(vecs1) > 0:
+      assert np.abs(vecs1 - vecs2).max() < tol
+  assert np.load('data/quant_1.vecs.npy').dtype == dtype
@@ -2,11 +2,20 @@
 creates a file that maps publications (list of values) to venues (keys).
 create_ert(venue, sample_size) concatenates the SRTs of a certain no. of
 its belonging documents, starting with the one with the most words in the
-vocabulary. This file can also be used for advisors and referees! """
+vocabulary. This file can also be used for advisors and referees!
 
+update_erts() maintains the ERTs incrementally: for each venue, a state file
+keeps a heap with its longest docs and the word counts of those docs, so that
+when new publications are added to the venues only the affected venues are
+updated and their entries in the ERT and BoW files are replaced. """
 
+
+import heapq
 import json
 from collections import Counter
+from os import path
+
+from json_stream import iter_items
 
 
 def get_publications():
@@ -39,17 +48,94 @@ def create_ert(docs, data, sample_size=4):
   enough docs, use all the available ones. """
   if len(docs) <= sample_size:
     ids = docs
-  else:
-    lens = {id: len(data[id]['title']) + len(data[id]['abstract']) 
-      for id in docs}
-    sorted_ids = [k for k, _ in sorted(lens.items(), key=lambda i: i[1])]
-    ids = sorted_ids[-sample_size:]
+  else:  # longest docs, the later ones first among those with equal length
+    keys = [(doc_len(data[id]), i) for i, id in enumerate(docs)]
+    ids = [docs[i] for _, i in sorted(heapq.nlargest(sample_size, keys))]
   words = []
   for id in ids:
     words += data[id]['title'] + data[id]['abstract']
   return {'bow': [w[0] for w in Counter(words).most_common()], 'ids': ids}
 
 
+def doc_len(doc):
+  """ Return the no. of words of the doc. """
+  return len(doc['title']) + len(doc['abstract'])
+
+
+def update_erts(venues_file, ert_file, bow_file, state_file, sample_size=4,
+    data_file='data/json/dim/all/data_lemmas_vocab.json'):
+  """ Update the ERTs of the venues that have new publications in the venues
+  file since the last call, and replace their entries in the ERT file and in
+  the BoW file (see get_bow()). The lists of publications are assumed to only
+  grow at the end, as get_publications() does when new publications are
+  appended to the relevant venues. The first call, without a state file,
+  computes the ERTs of all venues. The results equal those of get_erts().
+  The data file is streamed twice: first to get the lengths of the new
+  publications and then the words of those that are selected. """
+  publications = json.load(open(venues_file))
+  state = json.load(open(state_file)) if path.exists(state_file) else {}
+  new_docs = {}
+  for venue, ids in publications.items():
+    n = state[venue]['n'] if venue in state else 0
+    if len(ids) > n:
+      new_docs[venue] = list(enumerate(ids[n:], n))
+  if len(new_docs) == 0:
+    return
+  needed = {id for docs in new_docs.values() for _, id in docs}
+  lens = {id: doc_len(doc) for id, doc in iter_items(data_file) if id in needed}
+  for venue, docs in new_docs.items():
+    venue_state = state.setdefault(venue, {'n': 0, 'heap': [], 'counts': {}})
+    heap = [tuple(item) for item in venue_state['heap']]
+    for pos, id in docs:
+      if len(heap) < sample_size:
+        heapq.heappush(heap, (lens[id], pos, id))
+      else:
+        heapq.heappushpop(heap, (lens[id], pos, id))
+    venue_state['heap'] = heap
+    venue_state['n'] = pos + 1
+    selected = {id for _, _, id in heap}
+    venue_state['counts'] = {
+      id: cnt for id, cnt in venue_state['counts'].items() if id in selected
+    }
+  missing = {
+    id for venue in new_docs for _, _, id in state[venue]['heap']
+    if id not in state[venue]['counts']
+  }
+  counts = {}
+  if len(missing) > 0:
+    counts = {
+      id: Counter(doc['title'] + doc['abstract'])
+      for id, doc in iter_items(data_file) if id in missing
+    }
+  erts = json.load(open(ert_file)) if path.exists(ert_file) else {}
+  bows = json.load(open(bow_file)) if path.exists(bow_file) else {}
+  for venue in new_docs:
+    venue_state = state[venue]
+    for _, _, id in venue_state['heap']:
+      if id not in venue_state['counts']:
+        venue_state['counts'][id] = counts[id]
+    erts[venue] = state_ert(venue_state, sample_size)
+    bows[venue] = erts[venue]['bow']
+  json.dump(erts, open(ert_file, 'w'))
+  json.dump(bows, open(bow_file, 'w'))
+  json.dump(state, open(state_file, 'w'))
+
+
+def state_ert(venue_state, sample_size):
+  """ Return the ERT of a venue from its state, as create_ert() does. The
+  counts of the docs are added in the order in which create_ert() would
+  concatenate their words, so that ties are ordered in the same way. """
+  if venue_state['n'] <= sample_size:  # all docs, in their original order
+    items = sorted(venue_state['heap'], key=lambda item: item[1])
+  else:
+    items = sorted(venue_state['heap'])
+  ids = [id for _, _, id in items]
+  cnt = Counter()
+  for id in ids:
+    cnt.update(venue_state['counts'][id])
+  return {'bow': [w[0] for w in cnt.most_common()], 'ids': ids}
+
+
 def get_bow(ert_file, dump_file):
   """ The same as above, but only with the bow vectors, without the IDs. """
   ert = json.load(open(ert_file))